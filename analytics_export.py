@@ -0,0 +1,284 @@
+"""
+analytics_export.py
+
+Exports the analytical tables (transactions, fills, prices, model parameters)
+to typed Arrow files so notebooks stop re-parsing CSVs and ISO timestamps on
+every run, and provides a loader that memory-maps them and only reads the
+columns / rows that were asked for.
+
+Usage:
+1. python analytics_export.py export             # Feather (uncompressed Arrow IPC, zero-copy)
+2. python analytics_export.py export --parquet   # Parquet (smaller on disk, decoded on read)
+3. python analytics_export.py bench              # load time + peak memory vs the CSV path
+
+In a notebook:
+    from analytics_export import load_table
+    sells = load_table('transactions', columns=['item_id', 'time_to_fill_hours'],
+                       filters=[('side', '=', 'sell')])
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+
+from db import ensure_tables, get_repo
+
+EXPORT_DIR = 'data/analytics'
+
+TS = pa.timestamp('s', tz='UTC')
+
+SCHEMAS = {
+    # completed TP transactions from fetch_transaction_history.py
+    'transactions': pa.schema([
+        ('side', pa.dictionary(pa.int8(), pa.string())),
+        ('item_id', pa.int32()),
+        ('item_name', pa.string()),
+        ('quantity', pa.int32()),
+        ('price_copper', pa.int64()),
+        ('created', TS),
+        ('purchased', TS),
+        ('time_to_fill_hours', pa.float32()),
+    ]),
+    # fills derived by orders.persist_current_orders
+    'fills': pa.schema([
+        ('fill_id', pa.int64()),
+        ('user_id', pa.int32()),
+        ('order_id', pa.int64()),
+        ('item_id', pa.int32()),
+        ('side', pa.dictionary(pa.int8(), pa.string())),
+        ('quantity', pa.int32()),
+        ('unit_price', pa.int64()),
+        ('occurred_at', TS),
+        ('exchange_fee', pa.int64()),
+    ]),
+    # gw2efficiency exports (90 day aggregates + TP prices at export time)
+    'prices': pa.schema([
+        ('side', pa.dictionary(pa.int8(), pa.string())),
+        ('item_id', pa.int32()),
+        ('item_name', pa.string()),
+        ('item_amount', pa.int32()),
+        ('your_price', pa.int64()),
+        ('buy_price', pa.int64()),
+        ('sell_price', pa.int64()),
+    ]),
+    # Weibull fits from the fill model notebook, one row per item_id
+    'models': pa.schema([
+        ('item_id', pa.int32()),
+        ('item_name', pa.string()),
+        ('lambda_', pa.float64()),
+        ('rho_', pa.float64()),
+        ('n_observations', pa.int32()),
+        ('median_fill_hours', pa.float64()),
+        ('mean_fill_hours', pa.float64()),
+        ('std_fill_hours', pa.float64()),
+    ]),
+}
+
+
+def _read_history_csvs(pattern, side):
+    files = sorted(glob.glob(pattern))
+    if not files:
+        return pd.DataFrame(columns=[f.name for f in SCHEMAS['transactions']])
+    df = pd.concat([pd.read_csv(f) for f in files]).drop_duplicates()
+    df.insert(0, 'side', side)
+    return df
+
+
+def build_transactions():
+    df = pd.concat([
+        _read_history_csvs('data/buy_orders/buy_history_*.csv', 'buy'),
+        _read_history_csvs('data/sell_orders/sell_history_*.csv', 'sell'),
+    ], ignore_index=True)
+    for col in ('created', 'purchased'):
+        df[col] = pd.to_datetime(df[col], utc=True, format='ISO8601')
+    return df
+
+
+def build_fills():
+    ensure_tables()
+    cols = [f.name for f in SCHEMAS['fills']]
+    df = pd.DataFrame.from_records(get_repo().stream(f"SELECT {', '.join(cols)} FROM fills ORDER BY fill_id"),
+                                   columns=cols)
+    df['occurred_at'] = pd.to_datetime(df['occurred_at'], utc=True, format='ISO8601')
+    return df
+
+
+def build_prices():
+    frames = []
+    for side, path, own in (('buy', 'data/gw2efficiency_buy_history.csv', 'Your Buy Price'),
+                            ('sell', 'data/gw2efficiency_sell_history.csv', 'Your Sell Price')):
+        if not os.path.exists(path):
+            continue
+        bad = []   # malformed rows (extra fields) are skipped, but counted
+        df = pd.read_csv(path, engine='python', on_bad_lines=lambda line: bad.append(line)).rename(columns={
+            'Item ID': 'item_id',
+            'Item Name': 'item_name',
+            'Item Amount': 'item_amount',
+            own: 'your_price',
+            'Buy Price': 'buy_price',
+            'Sell Price': 'sell_price',
+        })
+        if bad:
+            print(f"prices: skipped {len(bad)} malformed rows in {path}")
+        df.insert(0, 'side', side)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=[f.name for f in SCHEMAS['prices']])
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_models(path='data/item_distributions.json',
+                 catalogue_path='data/my_trading_items.csv'):
+    """
+    Keyed by item_id. Older, name-keyed fits have no item_id and are mapped
+    through the trading catalogue (as model_store.build_from_json does);
+    fits that can't be mapped are left out.
+    """
+    with open(path) as f:
+        models = json.load(f)
+    df = pd.DataFrame(list(models.values()))
+    if 'item_id' not in df:
+        df['item_id'] = pd.NA
+    if df['item_id'].isna().any():
+        catalogue = pd.read_csv(catalogue_path)
+        name_to_id = dict(zip(catalogue['item_name'], catalogue['item_id'].astype(int)))
+        df['item_id'] = df['item_id'].fillna(df['item_name'].map(name_to_id))
+        unmapped = df.loc[df['item_id'].isna(), 'item_name'].tolist()
+        if unmapped:
+            print(f"models: no item_id for {', '.join(unmapped)}")
+        df = df.dropna(subset=['item_id'])
+    df['item_id'] = df['item_id'].astype(int)
+    return df.drop_duplicates('item_id', keep='last').sort_values('item_id')
+
+
+BUILDERS = {
+    'transactions': build_transactions,
+    'fills': build_fills,
+    'prices': build_prices,
+    'models': build_models,
+}
+
+
+def _to_arrow(name, df):
+    schema = SCHEMAS[name]
+    df = df[[f.name for f in schema]]
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def export_all(out_dir=EXPORT_DIR, fmt='feather'):
+    """Write every analytical table to out_dir; returns {table: path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for name, build in BUILDERS.items():
+        table = _to_arrow(name, build())
+        path = os.path.join(out_dir, f'{name}.{fmt}')
+        tmp = path + '.tmp'
+        if fmt == 'parquet':
+            pq.write_table(table, tmp, compression='zstd')
+        else:
+            # uncompressed so the loader can map buffers straight from disk
+            feather.write_feather(table, tmp, compression='uncompressed')
+        os.replace(tmp, path)
+        written[name] = path
+        print(f"Saved {table.num_rows} rows to {path}")
+    return written
+
+
+def _table_path(name, data_dir):
+    # the newest export wins, so a stale .feather can't hide a fresh .parquet
+    found = []
+    for fmt in ('feather', 'parquet'):
+        path = os.path.join(data_dir, f'{name}.{fmt}')
+        if os.path.exists(path):
+            found.append((os.path.getmtime(path), path, fmt))
+    if found:
+        _, path, fmt = max(found)
+        return path, fmt
+    raise FileNotFoundError(f"No export for '{name}' in {data_dir}; run `python analytics_export.py export`")
+
+
+def load_arrow(name, columns=None, filters=None, data_dir=EXPORT_DIR):
+    """
+    Memory-mapped read of one exported table as a pyarrow.Table.
+    columns: only these columns are read.
+    filters: DNF list like [('item_id', 'in', [24575, 84]), ('side', '=', 'sell')],
+             pushed down to row groups (Parquet) / record batches (Feather).
+    """
+    path, fmt = _table_path(name, data_dir)
+    dataset = ds.dataset(path, format='ipc' if fmt == 'feather' else 'parquet',
+                         filesystem=LocalFileSystem(use_mmap=True))
+    expr = pq.filters_to_expression(filters) if filters else None
+    return dataset.to_table(columns=columns, filter=expr)
+
+
+def load_table(name, columns=None, filters=None, data_dir=EXPORT_DIR):
+    """Same as load_arrow but returns a pandas DataFrame (timestamps stay tz-aware)."""
+    return load_arrow(name, columns, filters, data_dir).to_pandas()
+
+
+def _load_csv_path():
+    # what fill_model_v_batchFillProb.ipynb does today
+    df = build_transactions()
+    return df[df['side'] == 'sell'][['item_id', 'time_to_fill_hours']]
+
+
+def _load_arrow_path():
+    return load_table('transactions', columns=['item_id', 'time_to_fill_hours'],
+                      filters=[('side', '=', 'sell')])
+
+
+def _bench_child(kind, repeat):
+    # runs in a fresh interpreter so ru_maxrss is per loader, not cumulative
+    import resource
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fn = _load_csv_path if kind == 'csv' else _load_arrow_path
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        rows = len(fn())
+    elapsed = (time.perf_counter() - t0) / repeat
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'path': kind, 'rows': rows, 'load_ms': round(elapsed * 1000, 3),
+            'peak_rss_delta_kb': after - before}
+
+
+def benchmark(repeat=5):
+    """Load time and peak memory of the CSV path vs the exported Arrow path."""
+    import multiprocessing as mp
+    ctx = mp.get_context('spawn')
+    results = []
+    for kind in ('csv', 'arrow'):
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_bench_child, (kind, repeat)))
+    for r in results:
+        print(f"{r['path']:>6}: {r['rows']} rows, {r['load_ms']} ms/load, "
+              f"peak RSS +{r['peak_rss_delta_kb']} KB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export analytical tables to Arrow files')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    exp = sub.add_parser('export')
+    exp.add_argument('--parquet', action='store_true')
+    exp.add_argument('--out', default=EXPORT_DIR)
+    bench = sub.add_parser('bench')
+    bench.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == 'export':
+        export_all(args.out, 'parquet' if args.parquet else 'feather')
+    else:
+        benchmark(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+auth.py
+
+Login / registration policy around users.py, for the web app:
+
+- PBKDF2 (200k iterations, ~0.1-0.2 s of CPU each) runs in a small process pool
+  (HASH_WORKERS per web worker, at a lower CPU priority) instead of the request
+  thread, so a burst of logins can't take every core from the dashboard. The
+  request thread still waits for its hash, so at most MAX_PENDING logins per web
+  worker are in flight, well below its thread count; past that login/register
+  raise TimeoutError (the app answers 503 + Retry-After) instead of parking more
+  threads. TP_HASH_WORKERS=0 hashes inline in the request thread, as before.
+- Throttling: attempts per client IP, and failed attempts per email, in a sliding
+  window; over the limit raises Throttled before any hashing is done. Counters
+  live in each web worker process, so with N workers the effective limit is up
+  to N times higher. The IP is the forwarded client address (tp.py's ProxyFix,
+  TP_PROXY_HOPS), not the proxy's.
+- API keys: the GW2 key of a user is looked up once and cached (KEY_TTL) for the
+  upstream calls of all their requests; invalidate() drops it on logout or when
+  the key changes. The cache is per web worker process and invalidate() only
+  clears the worker it runs in: the other workers use a changed or revoked key
+  for up to KEY_TTL seconds longer.
+"""
+
+import functools
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from users import _hash_pw, _verify_pw, create_user, get_api_key, verify_user
+
+HASH_WORKERS = int(os.getenv('TP_HASH_WORKERS', '1'))
+MAX_PENDING = max(1, HASH_WORKERS) * 2  # one hashing, one queued per pool process
+QUEUE_WAIT = 0.1      # seconds to wait for a slot before answering "busy"
+HASH_TIMEOUT = 10
+
+LOGIN_PER_IP = int(os.getenv('TP_LOGIN_PER_IP', '20'))                 # attempts per minute
+LOGIN_FAILS_PER_EMAIL = int(os.getenv('TP_LOGIN_FAILS_PER_EMAIL', '5'))  # failures per 15 minutes
+
+KEY_TTL = 60  # seconds; also how long other workers may use an old key, see above
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"too many attempts, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class Throttle:
+    """At most `limit` hits per key in any `window` seconds (sliding log per key)."""
+
+    MAX_KEYS = 10_000  # sweep keys with no recent hits beyond this many
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        q = self._hits.get(key)
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        return q
+
+    def retry_after(self, key):
+        """Seconds until `key` may hit again; 0 when it may now."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(key, now)
+            if not q or len(q) < self.limit:
+                return 0
+            return q[0] + self.window - now
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._hits) >= self.MAX_KEYS:
+                for k in [k for k in self._hits if not self._recent(k, now)]:
+                    del self._hits[k]
+            self._hits.setdefault(key, deque()).append(now)
+
+    def clear(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+_per_ip = Throttle(LOGIN_PER_IP, 60)
+_failures_per_email = Throttle(LOGIN_FAILS_PER_EMAIL, 15 * 60)
+
+
+# ---------------------------------------------------------------- hashing pool
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _lower_priority():
+    os.nice(10)
+
+
+def _executor():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # created lazily, and again in a forked web worker (a pool isn't fork-safe)
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(HASH_WORKERS, mp_context=mp.get_context('forkserver'),
+                                        initializer=_lower_priority)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _offload(fn, *args):
+    """
+    fn(*args) in the hashing pool; TimeoutError when the pool is saturated,
+    BrokenProcessPool when a pool process died (the next call starts a new pool).
+    """
+    global _pool
+    if HASH_WORKERS == 0:
+        return fn(*args)
+    if not _slots.acquire(timeout=QUEUE_WAIT):
+        raise TimeoutError('password hashing is saturated')
+    try:
+        return _executor().submit(fn, *args).result(timeout=HASH_TIMEOUT)
+    except BrokenProcessPool:
+        with _pool_lock:
+            _pool = None  # a pool process died; start a fresh pool next time
+        raise
+    finally:
+        _slots.release()
+
+
+_hash_in_pool = functools.partial(_offload, _hash_pw)
+_verify_in_pool = functools.partial(_offload, _verify_pw)
+
+
+# ---------------------------------------------------------------- login / register
+
+def _check(ip, email=None):
+    wait = max(_per_ip.retry_after(ip), _failures_per_email.retry_after(email) if email else 0)
+    if wait:
+        raise Throttled(wait)
+    _per_ip.hit(ip)
+
+
+def login(email: str, password: str, ip: str) -> int | None:
+    """user_id, or None for a wrong email / password."""
+    email_key = email.strip().lower()
+    _check(ip, email_key)
+    user_id = verify_user(email, password, verify_pw=_verify_in_pool)
+    if user_id is None:
+        _failures_per_email.hit(email_key)
+    else:
+        _failures_per_email.clear(email_key)
+    return user_id
+
+
+def register(email: str, password: str, api_key: str, ip: str) -> int:
+    _check(ip)
+    user_id = create_user(email, password, api_key, hash_pw=_hash_in_pool)
+    invalidate(user_id)
+    return user_id
+
+
+# ---------------------------------------------------------------- API keys
+
+_keys = {}  # user_id -> (api_key, expires)
+
+
+def api_key(user_id: int) -> str | None:
+    """The user's GW2 API key, from the DB at most once per KEY_TTL."""
+    now = time.monotonic()
+    cached = _keys.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+    key = get_api_key(user_id)
+    _keys[user_id] = (key, now + KEY_TTL)
+    return key
+
+
+def invalidate(user_id: int) -> None:
+    _keys.pop(user_id, None)
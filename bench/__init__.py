@@ -0,0 +1 @@
+"""Local load-testing and benchmarking tools (stub GW2 API, load driver)."""
@@ -0,0 +1,165 @@
+"""
+bench/loadtest.py
+
+Reproducible local load test of the production entry point (wsgi.py under
+gunicorn) against the stub GW2 API. For every worker count it starts a fresh
+gunicorn with a throwaway SQLite file, drives each endpoint for a fixed time
+from a pool of client threads and reports p50/p99 latency and requests/sec.
+
+    python -m bench.loadtest --workers 1 2 4 --duration 10 --concurrency 16 --latency-ms 50
+
+Results are printed and, with --out, written as JSON.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench.stub_gw2 import make_market, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _endpoints(market):
+    ids = ','.join(str(i) for i in list(market['items'])[:10])
+    return {
+        '/': '/',
+        '/api/volume': f'/api/volume?ids={ids}',
+        '/api/items/search': '/api/items/search?q=jade',
+    }
+
+
+def _percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, int(round(pct / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def drive(url, duration, concurrency):
+    """Hammer one URL from `concurrency` threads for `duration` seconds."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def worker():
+        s = requests.Session()
+        mine, bad = [], 0
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                ok = s.get(url, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - t0)
+            else:
+                bad += 1
+        s.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += bad
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+def _wait_ready(base, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {proc.returncode}')
+        try:
+            requests.get(f'{base}/api/items/search?q=', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not come up')
+
+
+def run(worker_counts, duration, concurrency, latency_ms, threads, port=8765, orders=200):
+    market = make_market(orders)
+    stub, stub_base = serve(0, latency_ms, market)
+    results = []
+    try:
+        for n in worker_counts:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    **os.environ,
+                    'WEB_CONCURRENCY': str(n),
+                    'WEB_THREADS': str(threads),
+                    'BIND': f'127.0.0.1:{port}',
+                    'GW2_API_BASE': stub_base,
+                    'GW2_KEY': 'stub',
+                    'TP_DB_PATH': os.path.join(tmp, 'tp.sqlite'),
+                    'TP_MODEL_STORE': os.path.join(tmp, 'fill_models.npy'),  # tp builds it at import
+                    'LOG_LEVEL': 'warning',
+                }
+                proc = subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                    cwd=ROOT, env=env)
+                base = f'http://127.0.0.1:{port}'
+                try:
+                    _wait_ready(base, proc)
+                    for name, path in _endpoints(market).items():
+                        r = drive(base + path, duration, concurrency)
+                        r.update({'workers': n, 'threads': threads, 'endpoint': name})
+                        results.append(r)
+                        print(f"workers={n:<3} {name:<20} {r['rps']:>8} req/s  "
+                              f"p50={r['p50_ms']} ms  p99={r['p99_ms']} ms  errors={r['errors']}")
+                finally:
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=35)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.wait()
+    finally:
+        stub.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test wsgi.py against the stub GW2 API')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    results = run(args.workers, args.duration, args.concurrency, args.latency_ms,
+                  args.threads, args.port, args.orders)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'latency_ms': args.latency_ms, 'concurrency': args.concurrency,
+                       'results': results}, f, indent=2)
+        print(f'Saved results to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
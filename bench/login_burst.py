@@ -0,0 +1,147 @@
+"""
+bench/login_burst.py
+
+Dashboard latency while logins are running. For every --hash-workers value it
+starts wsgi.py under gunicorn against the stub GW2 API, registers a user, then
+drives one dashboard URL twice: alone, and while --logins client threads POST
+/login back to back. TP_HASH_WORKERS=0 hashes inline in the request thread
+(before auth.py); 1+ uses auth.py's process pool.
+
+    python -m bench.login_burst --hash-workers 0 1 --workers 2 --threads 8 --logins 32
+
+Throttling is lifted (TP_LOGIN_PER_IP) so the burst measures hashing, not the
+rate limiter; login clients wait out Retry-After when the server is busy. Results are printed and, with --out, written as JSON.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench.loadtest import ROOT, _wait_ready, drive
+from bench.stub_gw2 import make_market, serve
+
+EMAIL, PASSWORD = 'bench@example.com', 'bench-password'
+
+
+def burst(base, stop, n):
+    """n threads logging in until `stop` is set; returns status code counts."""
+    counts, lock = {}, threading.Lock()
+
+    def worker():
+        s = requests.Session()
+        mine = {}
+        while not stop.is_set():
+            try:
+                r = s.post(f'{base}/login', data={'email': EMAIL, 'password': PASSWORD},
+                           allow_redirects=False, timeout=60)
+                code = r.status_code
+            except requests.RequestException:
+                r, code = None, 'error'
+            mine[code] = mine.get(code, 0) + 1
+            if r is not None and 'Retry-After' in r.headers:  # as a client should on 429 / 503
+                stop.wait(float(r.headers['Retry-After']))
+        with lock:
+            for k, v in mine.items():
+                counts[k] = counts.get(k, 0) + v
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads, counts
+
+
+def run(hash_workers, workers, threads, logins, duration, concurrency, path, latency_ms, port=8766):
+    stub, stub_base = serve(0, latency_ms, make_market())
+    results = []
+    try:
+        for hw in hash_workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    **os.environ,
+                    'WEB_CONCURRENCY': str(workers),
+                    'WEB_THREADS': str(threads),
+                    'BIND': f'127.0.0.1:{port}',
+                    'GW2_API_BASE': stub_base,
+                    'GW2_KEY': 'stub',
+                    'TP_DB_PATH': os.path.join(tmp, 'tp.sqlite'),
+                    'TP_MODEL_STORE': os.path.join(tmp, 'fill_models.npy'),  # tp builds it at import
+                    'TP_HASH_WORKERS': str(hw),
+                    'TP_LOGIN_PER_IP': '1000000',
+                    'LOG_LEVEL': 'warning',
+                }
+                proc = subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                    cwd=ROOT, env=env)
+                base = f'http://127.0.0.1:{port}'
+                try:
+                    _wait_ready(base, proc)
+                    requests.post(f'{base}/register', allow_redirects=False, timeout=30,
+                                  data={'email': EMAIL, 'password': PASSWORD, 'api_key': 'stub'})
+                    requests.get(f'{base}/', timeout=60)  # persists the stub's orders for /api/orders
+                    drive(base + path, 1, concurrency)  # warm up
+                    quiet = drive(base + path, duration, concurrency)
+
+                    stop = threading.Event()
+                    login_threads, codes = burst(base, stop, logins)
+                    t0 = time.perf_counter()
+                    loaded = drive(base + path, duration, concurrency)
+                    stop.set()
+                    for t in login_threads:
+                        t.join()
+                    elapsed = time.perf_counter() - t0
+
+                    r = {
+                        'hash_workers': hw,
+                        'quiet': quiet,
+                        'during_logins': loaded,
+                        'logins_per_s': round(codes.get(302, 0) / elapsed, 1),
+                        'login_status': {str(k): v for k, v in codes.items()},
+                    }
+                    results.append(r)
+                    print(f"hash_workers={hw:<2} {path}: quiet p50={quiet['p50_ms']} p99={quiet['p99_ms']} ms | "
+                          f"with {logins} logins p50={loaded['p50_ms']} p99={loaded['p99_ms']} ms, "
+                          f"{r['logins_per_s']} logins/s, status {r['login_status']}")
+                finally:
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=35)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.wait()
+    finally:
+        stub.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dashboard latency during a login burst')
+    parser.add_argument('--hash-workers', type=int, nargs='+', default=[0, 1])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=32, help='concurrent login clients')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent dashboard clients')
+    parser.add_argument('--path', default='/api/orders?side=buy')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    results = run(args.hash_workers, args.workers, args.threads, args.logins, args.duration,
+                  args.concurrency, args.path, args.latency_ms, args.port)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'workers': args.workers, 'threads': args.threads, 'logins': args.logins,
+                       'path': args.path, 'results': results}, f, indent=2)
+        print(f'Saved results to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+"""
+bench/run.py
+
+Timed + memory-profiled scenarios for the hot paths, on seeded synthetic data
+(bench/synth.py) and the local stub GW2 API (bench/stub_gw2.py).
+
+    python -m bench.run                              # all scenarios, scale=small
+    python -m bench.run --scale medium -k persist    # only scenarios matching 'persist'
+    python -m bench.run compare bench/results/a.json bench/results/b.json
+
+    # same scenarios on PostgreSQL (tables in the target database are dropped!)
+    docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=tp -e POSTGRES_DB=tp postgres:16
+    python -m bench.run --database-url postgresql://postgres:tp@localhost:5432/tp
+
+Each run is saved to bench/results/<timestamp>.json with the git commit, so
+runs can be compared over time. Timing is the median of --repeat runs;
+memory is the tracemalloc peak of one extra run (Python allocations only).
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+from bench.synth import Synth
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+SCALES = {
+    #          items  orders/side  history/side  export rows
+    'small':  (1_000,    200,         500,         2_000),
+    'medium': (10_000,   2_000,       5_000,       20_000),
+    'large':  (27_000,   10_000,      20_000,      100_000),
+}
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register fn(ctx) -> (setup, run); setup() runs untimed before every run()."""
+    def wrap(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return wrap
+
+
+class Context:
+    def __init__(self, scale, seed, latency_ms, tmp, database_url=None):
+        self.n_items, self.n_orders, self.n_history, self.n_export = SCALES[scale]
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.tmp = tmp
+        self.database_url = database_url
+        self._stub = None
+        self._servers = []
+
+    def synth(self):
+        return Synth(self.n_items, self.seed)
+
+    def stub(self):
+        """Start the stub GW2 API once per run; returns its base URL."""
+        if self._stub is None:
+            from bench.stub_gw2 import make_market, serve
+            market = make_market(self.n_orders, self.n_items, self.seed, self.n_history)
+            self._stub = serve(0, self.latency_ms, market)
+        return self._stub[1]
+
+    def faulty_stub(self, faults):
+        """A separate stub answering with injected faults (bench.stub_gw2.Faults); returns (market, base URL)."""
+        from bench.stub_gw2 import make_market, serve
+        market = make_market(self.n_orders, self.n_items, self.seed, self.n_history)
+        server, base = serve(0, self.latency_ms, market, faults)
+        self._servers.append(server)
+        return market, base
+
+    def fresh_db(self, name):
+        import db
+        if self.database_url:
+            db.DATABASE_URL = self.database_url
+            with db.get_repo().transaction() as tx:
+                tx.execute("DROP SCHEMA public CASCADE")
+                tx.execute("CREATE SCHEMA public")
+            db.ensure_tables()
+            return self.database_url
+        path = os.path.join(self.tmp, f'{name}.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        db.DB_PATH = path
+        db.ensure_tables()
+        return path
+
+    def close(self):
+        if self._stub is not None:
+            self._stub[0].shutdown()
+        for server in self._servers:
+            server.shutdown()
+
+
+# ---------------------------------------------------------------- scenarios
+
+@scenario('persist_current_orders.first_poll')
+def _persist_first(ctx):
+    from orders import persist_current_orders
+    syn = ctx.synth()
+    buys, sells = syn.orders(ctx.n_orders, 'buy'), syn.orders(ctx.n_orders, 'sell')
+    return (lambda: ctx.fresh_db('persist_first'),
+            lambda: persist_current_orders(1, buys, sells))
+
+
+@scenario('persist_current_orders.diff_poll')
+def _persist_diff(ctx):
+    from orders import persist_current_orders
+    syn = ctx.synth()
+    buys, sells = syn.orders(ctx.n_orders, 'buy'), syn.orders(ctx.n_orders, 'sell')
+    buys2, sells2 = syn.partially_fill(buys), syn.partially_fill(sells)
+
+    def setup():
+        ctx.fresh_db('persist_diff')
+        persist_current_orders(1, buys, sells)
+    return setup, lambda: persist_current_orders(1, buys2, sells2)
+
+
+@scenario('persist_current_orders.concurrent_users')
+def _persist_concurrent(ctx):
+    # 8 poller threads, one user each: SQLite serializes them on its write lock,
+    # Postgres only on the per-user lock
+    from concurrent.futures import ThreadPoolExecutor
+    from orders import persist_current_orders
+    syn = ctx.synth()
+    n = max(ctx.n_orders // 8, 1)
+    polls = [(u, syn.orders(n, 'buy'), syn.orders(n, 'sell')) for u in range(1, 9)]
+    pool = ThreadPoolExecutor(8)
+
+    def run():
+        list(pool.map(lambda p: persist_current_orders(*p), polls))
+    return lambda: ctx.fresh_db('persist_concurrent'), run
+
+
+@scenario('fetch_names')
+def _fetch_names(ctx):
+    # a fresh DB every run: otherwise all but the first only read the items cache
+    base = ctx.stub()
+    import tp
+    tp.BASE = base
+    ids = ctx.synth().item_ids
+    return lambda: ctx.fresh_db('fetch_names'), lambda: tp.fetch_names(ids)
+
+
+class _Killed(Exception):
+    """Stands in for the process dying mid-crawl."""
+
+
+def _counting_session(kill_after=None):
+    """requests.Session counting the units (ids / pages) of 2xx answers; dies once kill_after were fetched."""
+    import requests
+
+    class Session(requests.Session):
+        fetched = 0
+
+        def get(self, url, **kw):
+            if kill_after is not None and self.fetched >= kill_after:
+                raise _Killed()
+            resp = super().get(url, **kw)
+            if resp.ok:
+                q = parse_qs(urlparse(url).query)
+                self.fetched += len(q['ids'][0].split(',')) if 'ids' in q else 1
+            return resp
+    return Session()
+
+
+@scenario('crawl.fault_resume')
+def _crawl_resume(ctx):
+    # crawl.py against a stub injecting random 5xx, 429 + Retry-After and timeouts on
+    # ?ids= above 50. Each crawl is killed partway and resumed from its checkpoint: the
+    # resumed run may only fetch what is missing, and the results must be complete.
+    # Most of its time is the stub's 1 s Retry-After waits.
+    import crawl
+    from bench.stub_gw2 import Faults
+    faults = Faults(error_rate=0.1, rate_limit=5, max_ids=50, seed=ctx.seed)
+    market, base = ctx.faulty_stub(faults)
+    crawl.BACKOFF_BASE = 0.05  # keep the bench about the crawl, not the sleeping
+    ids = sorted(market['prices'])
+    history = [t['id'] for t in market['history/buys']]
+
+    def killed_then_resumed(fetch, total, kill_after):
+        try:
+            fetch(_counting_session(kill_after))
+            raise AssertionError('crawl was not interrupted')
+        except _Killed:
+            pass
+        saved = sum(r['fetched'] for r in crawl.status())
+        assert 0 < saved < total, (saved, total)
+        http = _counting_session()
+        results = fetch(http)
+        assert http.fetched == total - saved, (http.fetched, total, saved)
+        assert crawl.status() == []  # checkpoint dropped once complete
+        return results
+
+    def setup():
+        ctx.fresh_db('crawl')
+        faults.counts.clear()
+
+    def run():
+        got = killed_then_resumed(
+            lambda http: crawl.fetch_ids('commerce/prices', ids, name='bench:prices', http=http, base=base),
+            len(ids), len(ids) // 3)
+        assert sorted(p['id'] for p in got) == ids
+        got = killed_then_resumed(
+            lambda http: crawl.fetch_pages('commerce/transactions/history/buys', name='bench:history',
+                                           http=http, base=base),
+            -(-len(history) // crawl.PAGE_SIZE), 1)
+        assert [t['id'] for t in got] == history
+        assert faults.counts.get(429) and any(status >= 500 for status in faults.counts), faults.counts
+    return setup, run
+
+
+@scenario('analyze_trading_portfolio')
+def _portfolio(ctx):
+    spec = importlib.util.spec_from_file_location('item_catalogue', os.path.join(ROOT, 'item catalogue.py'))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    syn = ctx.synth()
+    paths = {}
+    for side in ('buy', 'sell'):
+        paths[side] = os.path.join(ctx.tmp, f'gw2efficiency_{side}_history.csv')
+        with open(paths[side], 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(syn.gw2efficiency_rows(ctx.n_export, side))
+    return None, lambda: mod.analyze_trading_portfolio(paths['buy'], paths['sell'])
+
+
+@scenario('fill_model.recommender_full')
+def _recommender_full(ctx):
+    from order_recommender import OrderRecommender
+    orders, prices, models = _recommender_inputs(ctx)
+    return None, lambda: OrderRecommender().evaluate(orders, prices, models)
+
+
+@scenario('fill_model.recommender_incremental')
+def _recommender_incremental(ctx):
+    from order_recommender import OrderRecommender
+    orders, prices, models = _recommender_inputs(ctx)
+    rec = OrderRecommender()
+    changed = dict(prices)
+    # a realistic poll: ~2% of items moved
+    for i in list(changed)[::50]:
+        bid, ask = changed[i]
+        changed[i] = (bid + 1, ask)
+
+    def setup():
+        rec.evaluate(orders, prices, models)
+    return setup, lambda: rec.evaluate(orders, changed, models)
+
+
+def _recommender_inputs(ctx):
+    syn = ctx.synth()
+    orders = [{**o, 'user_id': 1, 'order_id': o['id'], 'side': side, 'unit_price': o['price'],
+               'quantity_open': o['quantity'], 'listing_fee': o['price'] * o['quantity'] * 5 // 100}
+              for side in ('buy', 'sell') for o in syn.orders(ctx.n_orders, side)]
+    prices = {p['id']: (p['buys']['unit_price'], p['sells']['unit_price']) for p in syn.price_snapshot()}
+    models = {i: (syn.rng.uniform(5, 200), syn.rng.uniform(0.8, 5)) for i in syn.item_ids}
+    return orders, prices, models
+
+
+@scenario('fill_model.weibull_fit')
+def _weibull_fit(ctx):
+    try:
+        from lifelines import WeibullFitter
+    except ImportError:
+        return None  # optional: lifelines is only needed in the notebook
+    import pandas as pd
+    hist = pd.DataFrame(ctx.synth().history(ctx.n_history, 'sells'))
+    hist['hours'] = (pd.to_datetime(hist['purchased']) - pd.to_datetime(hist['created'])).dt.total_seconds() / 3600
+    groups = [g['hours'] for _, g in hist.groupby('item_id') if len(g) >= 3]
+
+    def run():
+        for durations in groups:
+            WeibullFitter().fit(durations)
+    return None, run
+
+
+@scenario('indicators.update')
+def _indicators(ctx):
+    from indicators import IndicatorState
+    syn = ctx.synth()
+    first, second = syn.price_snapshot(), syn.price_snapshot()
+    state = IndicatorState()
+
+    def setup():
+        state.__init__()
+        state.update(first, ts=0)
+    return setup, lambda: state.update(second, ts=3600)
+
+
+@scenario('scanner.full_pass')
+def _scanner_full(ctx):
+    from scanner import OpportunityScanner
+    snap = ctx.synth().price_snapshot()
+    return None, lambda: OpportunityScanner().update(snap)
+
+
+@scenario('scanner.incremental')
+def _scanner_incremental(ctx):
+    from scanner import OpportunityScanner
+    syn = ctx.synth()
+    first = syn.price_snapshot()
+    # next snapshot: ~2% of the market moved
+    moved = {p['id']: p for p in syn.price_snapshot()}
+    second = [moved[p['id']] if n % 50 == 0 else p for n, p in enumerate(first)]
+    sc = OpportunityScanner()
+
+    def setup():
+        sc.__init__()
+        sc.update(first)
+    return setup, lambda: sc.update(second)
+
+
+# ---------------------------------------------------------------- runner
+
+def measure(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'repeat': repeat,
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'min_ms': round(min(times) * 1000, 3),
+        'max_ms': round(max(times) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(scale='small', seed=0, repeat=5, latency_ms=0, pattern=None, out_dir=RESULTS_DIR,
+            database_url=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        # the app modules read these at import time
+        os.environ['TP_DB_PATH'] = os.path.join(tmp, 'tp.sqlite')
+        os.environ['TP_MODEL_STORE'] = os.path.join(tmp, 'fill_models.npy')  # tp builds it on import
+        os.environ.setdefault('GW2_KEY', 'stub')
+        if database_url:
+            os.environ['DATABASE_URL'] = database_url
+        ctx = Context(scale, seed, latency_ms, tmp, database_url)
+        results = {}
+        try:
+            for name, make in SCENARIOS.items():
+                if pattern and pattern not in name:
+                    continue
+                prepared = make(ctx)
+                if prepared is None:
+                    print(f'{name:<40} skipped (optional dependency missing)')
+                    continue
+                r = measure(*prepared, repeat)
+                results[name] = r
+                print(f"{name:<40} {r['median_ms']:>10} ms  (min {r['min_ms']}, max {r['max_ms']})  "
+                      f"peak {r['peak_kb']} KB")
+        finally:
+            ctx.close()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'scale': scale, 'seed': seed, 'repeat': repeat, 'latency_ms': latency_ms,
+            'backend': 'postgresql' if database_url else 'sqlite',
+        },
+        'results': results,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    backend = '-pg' if database_url else ''
+    path = os.path.join(out_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{scale}{backend}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nSaved results to {path}')
+    return report
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'scenario':<40} {'old ms':>10} {'new ms':>10} {'change':>8}   peak KB old -> new")
+    for name, n in new['results'].items():
+        o = old['results'].get(name)
+        if not o:
+            print(f"{name:<40} {'-':>10} {n['median_ms']:>10}")
+            continue
+        change = (n['median_ms'] - o['median_ms']) / o['median_ms'] * 100 if o['median_ms'] else 0.0
+        print(f"{name:<40} {o['median_ms']:>10} {n['median_ms']:>10} {change:>+7.1f}%   "
+              f"{o['peak_kb']} -> {n['peak_kb']}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(prog='bench.run compare')
+        parser.add_argument('old')
+        parser.add_argument('new')
+        args = parser.parse_args(sys.argv[2:])
+        return compare(args.old, args.new)
+
+    parser = argparse.ArgumentParser(description='Hot-path benchmarks')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='per-request latency of the stub GW2 API')
+    parser.add_argument('-k', dest='pattern', help='only scenarios whose name contains this')
+    parser.add_argument('--out', default=RESULTS_DIR)
+    parser.add_argument('--database-url', help='run against this PostgreSQL database instead of SQLite')
+    args = parser.parse_args()
+    run_all(args.scale, args.seed, args.repeat, args.latency_ms, args.pattern, args.out, args.database_url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+bench/stub_gw2.py
+
+Local stand-in for the GW2 API endpoints the app calls, with a fixed
+per-request latency so slow upstream calls can be reproduced offline, and
+optional injected faults (random 5xx, 429 rate limiting with Retry-After,
+timeouts on oversized ?ids= requests) to exercise crawl.py's recovery.
+
+    python -m bench.stub_gw2 --port 8900 --latency-ms 50 --orders 200
+    python -m bench.stub_gw2 --error-rate 0.1 --rate-limit 50 --max-ids 50
+
+Point the app at it with GW2_API_BASE=http://127.0.0.1:8900/v2
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench.synth import Synth
+
+
+def make_market(n_orders=200, n_items=500, seed=0, n_history=200):
+    """Seeded account + market state served by the stub (see bench/synth.py)."""
+    syn = Synth(n_items, seed)
+    return {
+        'items': syn.items(),
+        'prices': {p['id']: p for p in syn.price_snapshot()},
+        'buys': syn.orders(n_orders, 'buy'),
+        'sells': syn.orders(n_orders, 'sell'),
+        'delivery': syn.delivery(),
+        'history/buys': syn.history(n_history, 'buys'),
+        'history/sells': syn.history(n_history, 'sells'),
+    }
+
+
+class Faults:
+    """Injected upstream trouble; seeded, so a run can be reproduced."""
+
+    def __init__(self, error_rate=0.0, rate_limit=0, max_ids=0, seed=0):
+        self.error_rate = error_rate  # share of requests answered 500 / 502 / 503
+        self.rate_limit = rate_limit  # requests per second; over it: 429 + Retry-After
+        self.max_ids = max_ids        # ?ids= requests with more ids: 504, as a big request timing out
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.second, self.in_second = 0, 0
+        self.counts = {}              # status -> requests answered with it
+
+    def check(self, n_ids):
+        """(status, headers) to answer instead of the real response, or None."""
+        with self.lock:
+            now = int(time.time())
+            if now != self.second:
+                self.second, self.in_second = now, 0
+            self.in_second += 1
+            if self.rate_limit and self.in_second > self.rate_limit:
+                fault = (429, {'Retry-After': '1'})
+            elif self.max_ids and n_ids > self.max_ids:
+                fault = (504, {})
+            elif self.rng.random() < self.error_rate:
+                fault = self.rng.choice([(500, {}), (502, {}), (503, {'Retry-After': '1'})])
+            else:
+                fault = None
+            key = fault[0] if fault else 200
+            self.counts[key] = self.counts.get(key, 0) + 1
+            return fault
+
+
+class _Handler(BaseHTTPRequestHandler):
+    market = None
+    latency = 0.0
+    faults = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # otherwise keep-alive replies stall ~40 ms on delayed ACKs
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _by_ids(self, table, qs):
+        if 'ids' not in qs:
+            return list(table.keys())
+        ids = [int(x) for x in qs['ids'][0].split(',') if x]
+        return [table[i] for i in ids if i in table]
+
+    def _page(self, rows, qs):
+        if 'page' not in qs:
+            return self._send(200, rows)
+        page, size = int(qs['page'][0]), int(qs.get('page_size', ['50'])[0])
+        total = max(1, -(-len(rows) // size))
+        if page >= total:
+            return self._send(400, {'text': f'page out of range. Use page values 0 - {total - 1}.'})
+        return self._send(200, rows[page * size:(page + 1) * size],
+                          {'X-Page-Total': str(total), 'X-Result-Total': str(len(rows))})
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(self.path)
+        qs = parse_qs(url.query)
+        path = url.path.removeprefix('/v2/')
+        m = self.market
+        if self.faults:
+            fault = self.faults.check(len(qs['ids'][0].split(',')) if 'ids' in qs else 0)
+            if fault:
+                return self._send(fault[0], {'text': 'injected fault'}, fault[1])
+        if path == 'commerce/transactions/current/buys':
+            return self._send(200, m['buys'])
+        if path == 'commerce/transactions/current/sells':
+            return self._send(200, m['sells'])
+        if path.startswith('commerce/transactions/history/'):
+            return self._page(m[path.removeprefix('commerce/transactions/')], qs)
+        if path == 'commerce/delivery':
+            return self._send(200, m['delivery'])
+        if path == 'commerce/prices':
+            return self._send(200, self._by_ids(m['prices'], qs))
+        if path == 'items':
+            return self._send(200, self._by_ids(m['items'], qs))
+        self._send(404, {'text': 'no such endpoint'})
+
+
+def serve(port=0, latency_ms=0, market=None, faults=None):
+    """Start the stub in a daemon thread; returns (server, base_url)."""
+    handler = type('Handler', (_Handler,), {
+        'market': market or make_market(), 'latency': latency_ms / 1000.0, 'faults': faults})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v2'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub GW2 API server')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--history', type=int, default=200, help='transactions per history endpoint')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per second, 0 = none')
+    parser.add_argument('--max-ids', type=int, default=0, help='?ids= requests above this time out, 0 = none')
+    args = parser.parse_args()
+    market = make_market(args.orders, args.items, args.seed, args.history)
+    faults = None
+    if args.error_rate or args.rate_limit or args.max_ids:
+        faults = Faults(args.error_rate, args.rate_limit, args.max_ids, args.seed)
+    server, base = serve(args.port, args.latency_ms, market, faults)
+    print(f'Stub GW2 API on {base} ({args.latency_ms} ms latency)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+bench/synth.py
+
+Seeded generator for realistic-looking GW2 trading data at any scale:
+price snapshots, open orders, delivery box, completed transaction history
+(/v2/commerce/transactions/history shape) and gw2efficiency-style exports.
+Same seed + same arguments -> same data, so benchmark runs are comparable.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+NOW = datetime(2025, 12, 15, 12, 0, tzinfo=timezone.utc)
+
+_ADJ = ['Superior', 'Major', 'Minor', 'Ascended', 'Exotic', 'Mystic', 'Jade', 'Zojja\'s', 'Zhed\'s', 'Ebon']
+_NOUN = ['Sigil of Bloodlust', 'Rune of Strength', 'Coat', 'Boots', 'Warhorn', 'Dye', 'Bot Core',
+         'Mask', 'Dagger', 'Hammer', 'Lodestone', 'Ingot', 'Scrap of Silk', 'Candy Corn']
+
+
+def _iso(dt):
+    return dt.isoformat(timespec='seconds')
+
+
+class Synth:
+    def __init__(self, n_items=1000, seed=0):
+        self.rng = random.Random(seed)
+        rng = self.rng
+        self.item_ids = sorted(rng.sample(range(1, 100_000), n_items))
+        # names repeat on purpose: GW2 item names are not unique
+        self.names = {i: f'{rng.choice(_ADJ)} {rng.choice(_NOUN)}' for i in self.item_ids}
+        # log-uniform prices: lots of cheap mats, a few very expensive items
+        self.base_sell = {i: int(10 ** rng.uniform(1.3, 5.5)) for i in self.item_ids}
+        self.base_supply = {i: int(10 ** rng.uniform(0, 5)) for i in self.item_ids}
+        self._next_order_id = 1_000_000
+
+    def price_snapshot(self, drift=0.02):
+        """/v2/commerce/prices entries for every item; each call random-walks prices."""
+        out = []
+        for i in self.item_ids:
+            sell = max(2, int(self.base_sell[i] * (1 + self.rng.gauss(0, drift))))
+            self.base_sell[i] = sell
+            supply = self.base_supply[i]
+            out.append({
+                'id': i, 'whitelisted': False,
+                'buys': {'quantity': self.rng.randint(0, supply * 2),
+                         'unit_price': max(1, int(sell * self.rng.uniform(0.6, 0.95)))},
+                'sells': {'quantity': self.rng.randint(0, supply * 2), 'unit_price': sell},
+            })
+        return out
+
+    def orders(self, n, side):
+        """/v2/commerce/transactions/current/{buys,sells} entries."""
+        out = []
+        for _ in range(n):
+            i = self.rng.choice(self.item_ids)
+            price = self.base_sell[i] if side == 'sell' else int(self.base_sell[i] * 0.8)
+            out.append({
+                'id': self._next_order_id, 'item_id': i, 'price': max(1, price),
+                'quantity': self.rng.randint(1, 250),
+                'created': _iso(NOW - timedelta(hours=self.rng.uniform(0, 240))),
+            })
+            self._next_order_id += 1
+        return out
+
+    def partially_fill(self, orders, frac=0.3, drop=0.1):
+        """Next poll of the same orders: some partially filled, some gone, a few new."""
+        out = []
+        for o in orders:
+            r = self.rng.random()
+            if r < drop:
+                continue
+            if r < drop + frac:
+                o = {**o, 'quantity': self.rng.randint(0, o['quantity'])}
+            out.append(o)
+        return out
+
+    def delivery(self, n_items=20):
+        """/v2/commerce/delivery payload."""
+        return {
+            'coins': self.rng.randint(0, 10_000_000),
+            'items': [{'id': i, 'count': self.rng.randint(1, 250)}
+                      for i in self.rng.sample(self.item_ids, min(n_items, len(self.item_ids)))],
+        }
+
+    def history(self, n, side):
+        """/v2/commerce/transactions/history/{buys,sells} entries with Weibull-ish fill times."""
+        out = []
+        for _ in range(n):
+            i = self.rng.choice(self.item_ids)
+            purchased = NOW - timedelta(hours=self.rng.uniform(0, 90 * 24))
+            wait = self.rng.weibullvariate(24 * self.rng.uniform(0.2, 4), self.rng.uniform(0.8, 3))
+            out.append({
+                'id': self._next_order_id, 'item_id': i,
+                'price': self.base_sell[i] if side == 'sells' else int(self.base_sell[i] * 0.8),
+                'quantity': self.rng.randint(1, 250),
+                'created': _iso(purchased - timedelta(hours=wait)),
+                'purchased': _iso(purchased),
+            })
+            self._next_order_id += 1
+        return out
+
+    def gw2efficiency_rows(self, n, side):
+        """Rows of the gw2efficiency buy/sell history export (header included)."""
+        own = 'Your Buy Price' if side == 'buy' else 'Your Sell Price'
+        rows = [['Item ID', 'Item Name', 'Item Amount', own, 'Buy Price', 'Sell Price']]
+        for _ in range(n):
+            i = self.rng.choice(self.item_ids)
+            sell = self.base_sell[i]
+            buy = int(sell * 0.8)
+            rows.append([i, self.names[i], self.rng.randint(1, 500),
+                         buy if side == 'buy' else sell, buy, sell])
+        return rows
+
+    def items(self):
+        """/v2/items entries (id + name is all the app reads)."""
+        return {i: {'id': i, 'name': self.names[i]} for i in self.item_ids}
@@ -0,0 +1,397 @@
+"""
+crawl.py
+
+Resumable bulk fetches from the GW2 API. A crawl is a list of units (item ids for
+?ids= endpoints, page numbers for paged ones) fetched in chunks. Every chunk is
+checkpointed to the DB (crawls / crawl_chunks) as it arrives, so a crawl that
+stops early (crash, Ctrl-C, out of retries, out of time) carries on from there
+the next time it runs under the same name, and one bad chunk costs that chunk,
+not the run.
+
+- Retries: 429, 5xx, timeouts and connection errors are retried with exponential
+  backoff and jitter; a Retry-After header is honoured when sent, up to
+  MAX_RETRY_AFTER.
+- Chunk size adapts: halved on a 5xx or timeout (large ?ids= requests are what
+  time out), doubled again after GROW_AFTER successes in a row, between
+  MIN_CHUNK and the endpoint's maximum (200 ids). The size is checkpointed too.
+- A chunk still failing after MAX_ATTEMPTS (or answering another 4xx) is skipped;
+  the crawl fetches the rest and raises CrawlIncomplete with everything it got.
+  Running it again fetches only what is missing.
+- max_wait caps the total time spent in backoff, for callers inside a web
+  request; running out raises CrawlIncomplete the same way.
+- 401/403 stop the crawl at once (HTTPError): retrying a bad key won't help.
+- checkpoint=False keeps a crawl in memory only, for callers that may run the
+  same crawl concurrently (web requests): two runs sharing one checkpoint would
+  delete each other's chunks.
+
+Checkpoints older than max_age are not resumed (a resumed price crawl shouldn't
+mix in yesterday's prices); they are deleted when the crawl completes, and
+abandoned ones after KEEP_SECONDS.
+
+Usage:
+    python crawl.py status          # crawls in progress
+    python crawl.py clear [NAME]    # drop checkpoints (all, or one crawl)
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from db import ensure_tables, get_repo
+
+BASE = os.getenv('GW2_API_BASE', 'https://api.guildwars2.com/v2')
+
+MAX_IDS = 200          # per ?ids= request, the API's limit
+PAGE_SIZE = 200        # per page, likewise
+MIN_CHUNK = 10
+GROW_AFTER = 5
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5     # seconds; attempt n waits up to BACKOFF_BASE * 2**(n-1)
+MAX_BACKOFF = 30
+MAX_RETRY_AFTER = 60   # seconds; a longer Retry-After is cut to this
+TIMEOUT = 10
+KEEP_SECONDS = 7 * 86400
+
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, 'http'):
+        _local.http = requests.Session()
+    return _local.http
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec='seconds')
+
+
+class CrawlIncomplete(Exception):
+    """Some units could not be fetched (yet); `results` holds everything that was."""
+
+    def __init__(self, name, results, missing):
+        super().__init__(f"crawl {name}: {len(missing)} units not fetched")
+        self.name = name
+        self.results = results
+        self.missing = missing
+
+
+class _Retry(Exception):
+    def __init__(self, reason, wait=None, shrink=False):
+        super().__init__(reason)
+        self.wait = wait
+        self.shrink = shrink
+
+
+class _Skip(Exception):
+    pass
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def retry_after(resp):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(attempt):
+    return random.uniform(0.5, 1.0) * min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+def _wait(retry, attempt):
+    """Seconds to wait before retrying: the server's Retry-After (capped), else backoff."""
+    if retry.wait is not None:
+        return min(retry.wait, MAX_RETRY_AFTER)
+    return backoff(attempt)
+
+
+class Crawl:
+    """One named crawl of `path`; run() fetches (or resumes) it and returns the concatenated results."""
+
+    def __init__(self, name, path, paged=False, headers=None, http=None,
+                 max_chunk=MAX_IDS, max_age=None, max_wait=None, base=None, checkpoint=True):
+        self.name = name
+        self.path = path
+        self.base = base or BASE
+        self.checkpoint = checkpoint
+        self.paged = paged
+        self.headers = headers
+        self.http = http or _session()
+        self.max_chunk = 1 if paged else max_chunk
+        self.max_age = max_age
+        self.max_wait = max_wait
+        self.size = self.max_chunk
+        self.streak = 0
+        self.slept = 0.0
+        self.requests = 0
+        self.skipped = []  # (first unit, last unit, reason)
+
+    # ------------------------------------------------------------ HTTP
+
+    def _get(self, query):
+        self.requests += 1
+        try:
+            resp = self.http.get(f"{self.base}/{self.path}?{query}", headers=self.headers, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _Retry(type(e).__name__, shrink=True)
+        if resp.status_code == 429:
+            raise _Retry('429 Too Many Requests', wait=retry_after(resp))
+        if resp.status_code >= 500:
+            raise _Retry(f'{resp.status_code} {resp.reason}', wait=retry_after(resp), shrink=True)
+        if resp.status_code in (401, 403):
+            resp.raise_for_status()
+        if resp.status_code == 404 and not self.paged:
+            return resp, []  # "all ids provided are invalid"
+        if resp.status_code == 400 and self.paged and 'page' in resp.text:
+            return resp, []  # page out of range: the list got shorter meanwhile
+        if resp.status_code >= 400:
+            raise _Skip(f'{resp.status_code} {resp.text[:200]}')
+        return resp, resp.json()  # 200, or 206 when some ids were invalid
+
+    def _query(self, units):
+        if self.paged:
+            return f'page={units[0]}&page_size={PAGE_SIZE}'
+        return f"ids={','.join(map(str, units))}"
+
+    def _sleep(self, seconds):
+        if self.max_wait is not None and self.slept + seconds > self.max_wait:
+            raise _OutOfTime()
+        self.slept += seconds
+        time.sleep(seconds)
+
+    # ------------------------------------------------------------ checkpoints
+
+    def _load(self):
+        if not self.checkpoint:
+            return None
+        with get_repo().transaction() as tx:
+            row = tx.execute("SELECT units, chunk_size, started_at FROM crawls WHERE name=?",
+                             (self.name,)).fetchone()
+            if row is None:
+                return None
+            age = datetime.utcnow() - datetime.fromisoformat(row['started_at'])
+            if self.max_age is not None and age > timedelta(seconds=self.max_age):
+                return None
+            done = {r['start']: (r['size'], json.loads(r['payload'])) for r in tx.execute(
+                "SELECT start, size, payload FROM crawl_chunks WHERE name=?", (self.name,))}
+        return json.loads(row['units']), row['chunk_size'], done
+
+    def _begin(self, units):
+        if not self.checkpoint:
+            return
+        now = _now()
+        with get_repo().transaction() as tx:
+            # start over: drop this crawl's old checkpoint and any long abandoned
+            cutoff = (datetime.utcnow() - timedelta(seconds=KEEP_SECONDS)).isoformat(timespec='seconds')
+            stale = [self.name] + [r['name'] for r in tx.execute(
+                "SELECT name FROM crawls WHERE updated_at < ?", (cutoff,))]
+            tx.executemany("DELETE FROM crawl_chunks WHERE name=?", [(n,) for n in stale])
+            tx.executemany("DELETE FROM crawls WHERE name=?", [(n,) for n in stale])
+            # upsert: another process may have begun the same crawl meanwhile
+            tx.execute("INSERT INTO crawls(name, path, units, chunk_size, started_at, updated_at) "
+                       "VALUES(?,?,?,?,?,?) ON CONFLICT(name) DO UPDATE SET path=excluded.path, "
+                       "units=excluded.units, chunk_size=excluded.chunk_size, "
+                       "started_at=excluded.started_at, updated_at=excluded.updated_at",
+                       (self.name, self.path, json.dumps(units), self.size, now, now))
+
+    def _save(self, start, size, payload):
+        if not self.checkpoint:
+            return
+        now = _now()
+        with get_repo().transaction() as tx:
+            tx.execute("INSERT INTO crawl_chunks(name, start, size, payload, fetched_at) VALUES(?,?,?,?,?) "
+                       "ON CONFLICT(name, start) DO NOTHING", (self.name, start, size, json.dumps(payload), now))
+            tx.execute("UPDATE crawls SET chunk_size=?, updated_at=? WHERE name=?", (self.size, now, self.name))
+
+    def _finish(self):
+        if not self.checkpoint:
+            return
+        with get_repo().transaction() as tx:
+            tx.execute("DELETE FROM crawl_chunks WHERE name=?", (self.name,))
+            tx.execute("DELETE FROM crawls WHERE name=?", (self.name,))
+
+    # ------------------------------------------------------------ crawl
+
+    def _with_retries(self, query):
+        """One request, retried as it is (nothing to resize)."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                return self._get(query)
+            except _Retry as r:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                self._sleep(_wait(r, attempt))
+
+    def _run_chunks(self, units, done):
+        covered = {i for start, (size, _) in done.items() for i in range(start, start + size)}
+        i, attempts, n = 0, 0, len(units)
+        while i < n:
+            if i in covered:
+                i += 1
+                continue
+            end = i
+            while end < n and end not in covered and end - i < self.size:
+                end += 1
+            try:
+                _, payload = self._get(self._query(units[i:end]))
+            except _Retry as r:
+                attempts += 1
+                self.streak = 0
+                if r.shrink and self.size > MIN_CHUNK:
+                    self.size = max(MIN_CHUNK, self.size // 2)
+                if attempts < MAX_ATTEMPTS:
+                    self._sleep(_wait(r, attempts))
+                    continue
+                reason = str(r)
+            except _Skip as s:
+                reason = str(s)
+            else:
+                self._save(i, end - i, payload)
+                done[i] = (end - i, payload)
+                i, attempts = end, 0
+                self.streak += 1
+                if self.streak >= GROW_AFTER and self.size < self.max_chunk:
+                    self.size, self.streak = min(self.max_chunk, self.size * 2), 0
+                continue
+            # give up on this chunk for this run; the next run retries it
+            self.skipped.append((units[i], units[end - 1], reason))
+            print(f"crawl {self.name}: skipped {units[i]}..{units[end - 1]} ({reason})", file=sys.stderr)
+            i, attempts = end, 0
+
+    def run(self, units=None):
+        """
+        units: list, or a callable returning it, only called when there is no
+        checkpoint to resume (a resumed crawl keeps its original units). Paged
+        crawls pass nothing: the page count comes from the first page.
+        """
+        if self.checkpoint:
+            ensure_tables()
+        state = self._load()
+        if state is not None:
+            units, self.size, done = state
+        else:
+            done = {}
+            first = None
+            if self.paged:
+                try:
+                    resp, first = self._with_retries(self._query([0]))
+                except (_Retry, _Skip, _OutOfTime) as e:
+                    raise CrawlIncomplete(self.name, [], [0]) from e
+                units = list(range(int(resp.headers.get('X-Page-Total', 1))))
+            else:
+                units = list(dict.fromkeys(units() if callable(units) else units))
+            self._begin(units)
+            if first is not None:
+                self._save(0, 1, first)
+                done[0] = (1, first)
+
+        try:
+            self._run_chunks(units, done)
+        except _OutOfTime:
+            pass
+        results = [x for start in sorted(done) for x in done[start][1]]
+        covered = {i for start, (size, _) in done.items() for i in range(start, start + size)}
+        missing = [u for i, u in enumerate(units) if i not in covered]
+        if missing:
+            raise CrawlIncomplete(self.name, results, missing)
+        self._finish()
+        return results
+
+
+def _digest(units):
+    return hashlib.sha1(','.join(map(str, units)).encode()).hexdigest()[:12]
+
+
+def fetch_ids(path, ids, name=None, **kw):
+    """
+    Every object of a ?ids= endpoint for `ids`, resumably. name defaults to one
+    derived from path and ids (so the same call resumes); pass one when ids is
+    a callable. Keyword arguments go to Crawl.
+    """
+    if name is None:
+        ids = list(dict.fromkeys(ids))
+        name = f'{path}:{_digest(ids)}'
+    return Crawl(name, path, **kw).run(ids)
+
+
+def fetch_pages(path, name=None, **kw):
+    """Every page of a paged endpoint (page / page_size / X-Page-Total), resumably."""
+    return Crawl(name or path, path, paged=True, **kw).run()
+
+
+def get_json(path, headers=None, http=None, max_wait=None, base=None):
+    """
+    A single GET with the same retry / backoff as a crawl (no checkpoint).
+    TimeoutError once retries or max_wait run out, HTTPError on other 4xx.
+    """
+    path, _, query = path.partition('?')
+    c = Crawl(path, path, headers=headers, http=http, max_wait=max_wait, base=base, checkpoint=False)
+    try:
+        return c._with_retries(query)[1]
+    except (_Retry, _OutOfTime) as e:
+        raise TimeoutError(f'{path}: gave up retrying ({e})') from e
+    except _Skip as e:
+        raise requests.HTTPError(f'{path}: {e}') from e
+
+
+def status():
+    ensure_tables()
+    with get_repo().transaction() as tx:
+        return [dict(r) for r in tx.execute("""
+            SELECT c.name, c.path, c.chunk_size, c.started_at, c.updated_at, c.units,
+                   (SELECT COALESCE(SUM(size), 0) FROM crawl_chunks k WHERE k.name = c.name) AS fetched
+            FROM crawls c ORDER BY c.updated_at DESC
+        """)]
+
+
+def clear(name=None):
+    ensure_tables()
+    with get_repo().transaction() as tx:
+        if name is None:
+            tx.execute("DELETE FROM crawl_chunks")
+            tx.execute("DELETE FROM crawls")
+        else:
+            tx.execute("DELETE FROM crawl_chunks WHERE name=?", (name,))
+            tx.execute("DELETE FROM crawls WHERE name=?", (name,))
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if cmd == 'status':
+        rows = status()
+        if not rows:
+            print("no crawls in progress")
+        for r in rows:
+            total = len(json.loads(r['units']))
+            print(f"{r['name']:<40} {r['fetched']:>6}/{total:<6} chunk={r['chunk_size']:<4} "
+                  f"started={r['started_at']} updated={r['updated_at']}")
+    elif cmd == 'clear':
+        clear(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+# db — persistence (SQLite by default, PostgreSQL for multi-account deployments)
+#
+# Modules go through get_repo() (db/repo.py) instead of opening connections
+# themselves. DATABASE_URL picks the backend; without it the SQLite file at
+# TP_DB_PATH is used.
+
+import os
+
+from db.engine import open_repo
+
+DB_PATH = os.getenv("TP_DB_PATH", "tp.sqlite")
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+_repos = {}
+
+def get_repo():
+    """The process-wide Repository for DATABASE_URL (or the SQLite file at DB_PATH)."""
+    url = DATABASE_URL or f"sqlite:///{DB_PATH}"
+    if url not in _repos:
+        _repos[url] = open_repo(url)
+    return _repos[url]
+
+def ensure_tables():
+    get_repo().ensure_schema()
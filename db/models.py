@@ -1,42 +1,171 @@
-"""from sqlalchemy import Integer, String, Text, CheckConstraint, DateTime
-from sqlalchemy.orm import Mapped, mapped_column
-from .engine import Base
-from datetime import datetime
-
-class OpenOrder(Base):
-    __tablename__ = "open_orders"
-    order_id:       Mapped[int] = mapped_column(Integer, primary_key=True)
-    item_id:        Mapped[int] = mapped_column(Integer, nullable=False)
-    side:           Mapped[str] = mapped_column(String, nullable=False)  # 'buy'|'sell'
-    unit_price:     Mapped[int] = mapped_column(Integer, nullable=False)  # copper
-    quantity_total: Mapped[int] = mapped_column(Integer, nullable=False)
-    quantity_open:  Mapped[int] = mapped_column(Integer, nullable=False)
-    listing_fee:    Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    created_at:     Mapped[datetime] = mapped_column(DateTime, nullable=False)
-    updated_at:     Mapped[datetime] = mapped_column(DateTime, nullable=False)
-    last_seen_poll: Mapped[datetime] = mapped_column(DateTime, nullable=False)
-    __table_args__ = (CheckConstraint("side in ('buy','sell')"),)
-
-class Fill(Base):
-    __tablename__ = "fills"
-    fill_id:    Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    order_id:   Mapped[int | None] = mapped_column(Integer)
-    item_id:    Mapped[int] = mapped_column(Integer, nullable=False)
-    side:       Mapped[str] = mapped_column(String, nullable=False)
-    quantity:   Mapped[int] = mapped_column(Integer, nullable=False)
-    unit_price: Mapped[int] = mapped_column(Integer, nullable=False)
-    occurred_at:Mapped[datetime] = mapped_column(DateTime, nullable=False)
-    exchange_fee: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    __table_args__ = (CheckConstraint("side in ('buy','sell')"),)
-
-class DailySnapshot(Base):
-    __tablename__ = "daily_snapshots"
-    snapshot_date: Mapped[str] = mapped_column(String, primary_key=True)  # YYYY-MM-DD
-    grand_copper:  Mapped[int] = mapped_column(Integer, nullable=False)
-
-class DailyItemVolume(Base):
-    __tablename__ = "daily_item_volume"
-    item_id:       Mapped[int] = mapped_column(Integer, primary_key=True)
-    snapshot_date: Mapped[str] = mapped_column(String, primary_key=True)
-    volume:        Mapped[int] = mapped_column(Integer, nullable=False)
-"""
\ No newline at end of file
+# db/models.py — table definitions shared by every backend.
+#
+# Written once in SQLite's dialect; postgres_ddl() rewrites the few places
+# where Postgres differs (identity columns, 64-bit integers, timestamp default).
+
+import re
+
+TABLES = [
+    # Simple users table (not used yet by app routes; no password/login logic here)
+    """
+    CREATE TABLE IF NOT EXISTS users (
+      user_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+      email         TEXT UNIQUE,
+      password_hash TEXT,
+      salt          TEXT,
+      api_key       TEXT,
+      created_at    TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+
+    # Live open orders per user
+    """
+    CREATE TABLE IF NOT EXISTS open_orders (
+      user_id        INTEGER NOT NULL,
+      order_id       INTEGER NOT NULL,
+      item_id        INTEGER NOT NULL,
+      side           TEXT NOT NULL CHECK(side IN ('buy','sell')),
+      unit_price     INTEGER NOT NULL,
+      quantity_total INTEGER NOT NULL,
+      quantity_open  INTEGER NOT NULL,
+      listing_fee    INTEGER NOT NULL DEFAULT 0,   -- 5% for sells at placement
+      created_at     TEXT NOT NULL,
+      updated_at     TEXT NOT NULL,
+      last_seen_poll TEXT NOT NULL,
+      PRIMARY KEY (user_id, order_id)
+    )""",
+
+    # Fills derived from quantity deltas (and later cross-checked with history)
+    """
+    CREATE TABLE IF NOT EXISTS fills (
+      fill_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id      INTEGER NOT NULL,
+      order_id     INTEGER,
+      item_id      INTEGER NOT NULL,
+      side         TEXT NOT NULL CHECK(side IN ('buy','sell')),
+      quantity     INTEGER NOT NULL,
+      unit_price   INTEGER NOT NULL,
+      occurred_at  TEXT NOT NULL,
+      exchange_fee INTEGER NOT NULL DEFAULT 0       -- 10% on sells per filled qty
+    )""",
+
+    # Append-only order lifecycle log, written in the same transaction as the
+    # open_orders diff. seq only ever grows (AUTOINCREMENT never reuses ids),
+    # so consumers track "last seq processed" and read only what is new.
+    """
+    CREATE TABLE IF NOT EXISTS order_events (
+      seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id        INTEGER NOT NULL,
+      order_id       INTEGER NOT NULL,
+      item_id        INTEGER NOT NULL,
+      side           TEXT NOT NULL CHECK(side IN ('buy','sell')),
+      event          TEXT NOT NULL CHECK(event IN ('placed','filled','repriced','closed')),
+      unit_price     INTEGER NOT NULL,
+      quantity       INTEGER NOT NULL,   -- placed: listed qty, filled: filled qty, closed: qty left open
+      quantity_open  INTEGER NOT NULL,   -- open qty after this event
+      fee            INTEGER NOT NULL DEFAULT 0,  -- listing fee (placed/repriced sells) or exchange fee (filled sells)
+      occurred_at    TEXT NOT NULL
+    )""",
+
+    # Per-consumer offsets into order_events
+    """
+    CREATE TABLE IF NOT EXISTS event_offsets (
+      consumer   TEXT PRIMARY KEY,
+      last_seq   INTEGER NOT NULL DEFAULT 0,
+      updated_at TEXT NOT NULL
+    )""",
+
+    # Per-user watchlist
+    """
+    CREATE TABLE IF NOT EXISTS favorites (
+      user_id    INTEGER NOT NULL,
+      item_id    INTEGER NOT NULL,
+      created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (user_id, item_id)
+    )""",
+
+    # Item names cached from /v2/items (names never change, ids are stable)
+    """
+    CREATE TABLE IF NOT EXISTS items (
+      item_id INTEGER PRIMARY KEY,
+      name    TEXT NOT NULL
+    )""",
+
+    # Latest /v2/commerce/prices per item (global, overwritten each fetch)
+    """
+    CREATE TABLE IF NOT EXISTS item_prices (
+      item_id    INTEGER PRIMARY KEY,
+      buy        INTEGER NOT NULL,   -- highest buy order
+      sell       INTEGER NOT NULL,   -- lowest sell listing
+      buy_qty    INTEGER NOT NULL,
+      sell_qty   INTEGER NOT NULL,
+      updated_at TEXT NOT NULL
+    )""",
+
+    """
+    CREATE TABLE IF NOT EXISTS daily_item_volume (
+      item_id       INTEGER,
+      snapshot_date TEXT,
+      volume        INTEGER,
+      PRIMARY KEY(item_id, snapshot_date)
+    )""",
+
+    # Account value per day (orders + delivery box), for the dashboard sparkline
+    """
+    CREATE TABLE IF NOT EXISTS daily_snapshots (
+      snapshot_date TEXT PRIMARY KEY,
+      grand_copper  INTEGER NOT NULL
+    )""",
+
+    # Bulk GW2 fetches in progress (crawl.py): the units to fetch (ids or page
+    # numbers) and every chunk fetched so far, so an interrupted crawl resumes.
+    # Both are deleted once the crawl completes.
+    """
+    CREATE TABLE IF NOT EXISTS crawls (
+      name       TEXT PRIMARY KEY,
+      path       TEXT NOT NULL,
+      units      TEXT NOT NULL,     -- JSON list
+      chunk_size INTEGER NOT NULL,  -- adapted size, carried over on resume
+      started_at TEXT NOT NULL,
+      updated_at TEXT NOT NULL
+    )""",
+
+    """
+    CREATE TABLE IF NOT EXISTS crawl_chunks (
+      name       TEXT NOT NULL,
+      start      INTEGER NOT NULL,  -- index into crawls.units
+      size       INTEGER NOT NULL,
+      payload    TEXT NOT NULL,     -- JSON list returned for units[start:start+size]
+      fetched_at TEXT NOT NULL,
+      PRIMARY KEY (name, start)
+    )""",
+]
+
+# Indexes for per-user lookups by item and cheap "did anything change" checks
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_user_item ON open_orders(user_id, item_id)",
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_user_updated ON open_orders(user_id, updated_at)",
+    # /api/orders pages: one per sort key, see Repository.ORDER_SORTS
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_page_item ON open_orders(user_id, side, item_id, order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_page_price ON open_orders(user_id, side, unit_price, order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_page_age ON open_orders(user_id, side, created_at, order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_open_orders_page_capital "
+    "ON open_orders(user_id, side, (unit_price * quantity_open), order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_item_prices_updated ON item_prices(updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_order_events_user_seq ON order_events(user_id, seq)",
+    "CREATE INDEX IF NOT EXISTS ix_daily_item_volume_date ON daily_item_volume(snapshot_date)",
+]
+
+_PG_REWRITES = [
+    (re.compile(r"INTEGER PRIMARY KEY AUTOINCREMENT"), "BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"),
+    # copper totals and price*qty products overflow Postgres' 32-bit INTEGER
+    (re.compile(r"\bINTEGER\b"), "BIGINT"),
+    # same text format SQLite's CURRENT_TIMESTAMP produces
+    (re.compile(r"DEFAULT CURRENT_TIMESTAMP"),
+     "DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"),
+]
+
+
+def postgres_ddl(sql):
+    for pattern, repl in _PG_REWRITES:
+        sql = pattern.sub(repl, sql)
+    return sql
@@ -0,0 +1,135 @@
+# db/postgres.py — PostgreSQL backend (psycopg 3).
+#
+# Same queries as SQLite (db/repo.py), with:
+# - per-key advisory locks, so polls for different users write concurrently
+#   instead of queueing behind SQLite's single writer;
+# - COPY for bulk appends, and COPY into a temp table + one INSERT .. ON CONFLICT
+#   for bulk upserts; small batches use executemany (pipelined by psycopg);
+# - named (server-side) cursors for large reads, fetched STREAM_BATCH rows at a time.
+
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import psycopg
+except ImportError:  # optional: only needed when DATABASE_URL points at Postgres
+    psycopg = None
+
+from db.models import postgres_ddl
+from db.repo import STREAM_BATCH, Repository, Tx
+
+COPY_MIN_ROWS = 500  # below this, executemany is as fast as COPY
+
+
+def _sql(sql):
+    """qmark placeholders -> psycopg's %s."""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+
+class Row(tuple):
+    """sqlite3.Row look-alike: row[0], row['name'], dict(row), iterates values."""
+
+    def __new__(cls, values, index):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def row_factory(cursor):
+    index = {c.name: i for i, c in enumerate(cursor.description or ())}
+    return lambda values: Row(values, index)
+
+
+class PostgresTx(Tx):
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(_sql(sql), params)
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if rows:
+            with self.conn.cursor() as cur:
+                cur.executemany(_sql(sql), rows)
+
+    def lock(self, key):
+        self.conn.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (key,))
+
+    def create_table(self, ddl):
+        self.conn.execute(postgres_ddl(ddl))
+
+    def _copy(self, table, cols, rows):
+        with self.conn.cursor() as cur:
+            with cur.copy(f"COPY {table} ({','.join(cols)}) FROM STDIN") as copy:
+                for r in rows:
+                    copy.write_row(tuple(r[c] for c in cols))
+
+    def insert_rows(self, table, rows):
+        if len(rows) < COPY_MIN_ROWS:
+            return super().insert_rows(table, rows)
+        self._copy(table, list(rows[0]), rows)
+
+    def upsert_rows(self, table, rows, key, update=None):
+        if len(rows) < COPY_MIN_ROWS:
+            return super().upsert_rows(table, rows, key, update)
+        cols = list(rows[0])
+        update = update or [c for c in cols if c not in key]
+        stage = f"stage_{table}"
+        self.conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table})")
+        self._copy(stage, cols, rows)
+        self.conn.execute(f"""
+          INSERT INTO {table}({','.join(cols)}) SELECT {','.join(cols)} FROM {stage}
+          ON CONFLICT({','.join(key)}) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in update)}
+        """)
+        self.conn.execute(f"TRUNCATE {stage}")
+
+
+class PostgresRepository(Repository):
+
+    HISTORY_AGG = "json_agg(json_build_array(snapshot_date, volume) ORDER BY snapshot_date DESC)"
+
+    def __init__(self, url):
+        if psycopg is None:
+            raise RuntimeError('DATABASE_URL is a PostgreSQL URL but psycopg is not installed '
+                               '(pip install "psycopg[binary]")')
+        self.url = url
+        self._local = threading.local()
+        self._cursor_ids = itertools.count()
+
+    def connect(self, autocommit=True):
+        return psycopg.connect(self.url, autocommit=autocommit, row_factory=row_factory)
+
+    def _thread_conn(self):
+        """One connection per thread, reopened after a fork or a dropped connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed or self._local.pid != os.getpid():
+            conn = self._local.conn = self.connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self, lock=None):
+        conn = self._thread_conn()
+        with conn.transaction():
+            tx = PostgresTx(conn)
+            if lock is not None:
+                tx.lock(lock)
+            yield tx
+
+    def stream(self, sql, params=(), size=STREAM_BATCH):
+        # own connection: a named cursor lives inside a transaction that must stay
+        # open while the caller iterates, independent of the thread's connection
+        with self.connect(autocommit=False) as conn:
+            with conn.cursor(name=f"stream_{next(self._cursor_ids)}") as cur:
+                cur.itersize = size
+                cur.execute(_sql(sql), params)
+                yield from cur
@@ -1,65 +1,388 @@
-"""from datetime import datetime
-from sqlalchemy import select, update, insert, func
-from .engine import SessionLocal, Base, engine
-from .models import OpenOrder, Fill, DailySnapshot, DailyItemVolume
-
-def init_db():
-    Base.metadata.create_all(engine)
-
-def persist_current_orders(buys: list[dict], sells: list[dict]) -> None:
-    now = datetime.utcnow()
-    all_orders = [{**o,'side':'buy'} for o in buys] + [{**o,'side':'sell'} for o in sells]
-    seen = set()
-    with SessionLocal() as s:
-        # cache previous open qty
-        prev = {oo.order_id: oo for oo in s.scalars(select(OpenOrder))}
-        for o in all_orders:
-            oid, item, side = o["id"], o["item_id"], o["side"]
-            price, qty = o["price"], o["quantity"]
-            created = datetime.fromisoformat(o.get("created")) if o.get("created") else now
-            seen.add(oid)
-
-            if oid in prev:
-                oo = prev[oid]
-                delta = max(0, oo.quantity_open - qty)
-                if delta > 0:
-                    exh_fee = (price * delta * 10) // 100 if side == "sell" else 0
-                    s.add(Fill(order_id=oid, item_id=item, side=side, quantity=delta,
-                               unit_price=price, occurred_at=now, exchange_fee=exh_fee))
-                # upsert
-                s.execute(update(OpenOrder).where(OpenOrder.order_id==oid).values(
-                    item_id=item, side=side, unit_price=price, quantity_total=qty,
-                    quantity_open=qty, updated_at=now, last_seen_poll=now
-                ))
-            else:
-                listing = (price * qty * 5) // 100 if side == "sell" else 0
-                s.add(OpenOrder(order_id=oid, item_id=item, side=side,
-                                unit_price=price, quantity_total=qty, quantity_open=qty,
-                                listing_fee=listing, created_at=created,
-                                updated_at=now, last_seen_poll=now))
-        # delete vanished (closed) orders
-        if seen:
-            s.query(OpenOrder).filter(~OpenOrder.order_id.in_(seen)).delete(synchronize_session=False)
-        else:
-            s.query(OpenOrder).delete()
-        s.commit()
-
-def upsert_snapshot(grand_copper: int, item_ids: set[int], fetch_prices_fn) -> None:
-    # fetch_prices_fn(ids_chunk) -> list of dicts with {'id','volume'}
-    today = datetime.utcnow().date().isoformat()
-    with SessionLocal() as s:
-        # daily_snapshots
-        row = s.get(DailySnapshot, today)
-        if row: row.grand_copper = grand_copper
-        else:   s.add(DailySnapshot(snapshot_date=today, grand_copper=grand_copper))
+# db/repo.py — the repository interface every module goes through, plus the SQLite backend.
+#
+# Queries are written once, in qmark style (?) and the SQL both SQLite and
+# Postgres understand (ON CONFLICT upserts, RETURNING). A backend supplies
+# connections, transactions with an optional lock, and the bulk paths:
+# insert_rows / upsert_rows for many rows at once and stream() for big reads.
 
+import json
+import sqlite3
+from contextlib import contextmanager
+
+from db.models import INDEXES, TABLES
+
+STREAM_BATCH = 5000
+
+
+class Repository:
+    """Backend-neutral queries. Subclasses implement connect/transaction/stream/create_table."""
+
+    # one JSON array of [snapshot_date, volume] pairs, newest first
+    HISTORY_AGG = None
+
+    def transaction(self, lock=None):
+        """
+        Context manager yielding a Tx; commits on success, rolls back on error.
+        lock: key serializing writers that must not interleave (e.g. one user's
+        order diff). SQLite can only take its single write lock; Postgres locks
+        just that key, so different keys write concurrently.
+        """
+        raise NotImplementedError
+
+    def stream(self, sql, params=(), size=STREAM_BATCH):
+        """Iterate a large result without loading it all (server-side cursor on Postgres)."""
+        raise NotImplementedError
+
+    def ensure_schema(self):
+        with self.transaction() as tx:
+            for ddl in TABLES:
+                tx.create_table(ddl)
+            for ddl in INDEXES:
+                tx.execute(ddl)
+
+    # ------------------------------------------------------------ users
+
+    def user_by_email(self, email):
+        with self.transaction() as tx:
+            return tx.execute("SELECT user_id, password_hash, salt FROM users WHERE email=?", (email,)).fetchone()
+
+    def create_user(self, email, password_hash, salt, api_key):
+        """Insert a user; returns the new user_id, or None when the email is taken."""
+        with self.transaction() as tx:
+            row = tx.execute("""
+              INSERT INTO users(email,password_hash,salt,api_key) VALUES(?,?,?,?)
+              ON CONFLICT(email) DO NOTHING RETURNING user_id
+            """, (email, password_hash, salt, api_key)).fetchone()
+            return row["user_id"] if row else None
+
+    def get_api_key(self, user_id):
+        with self.transaction() as tx:
+            row = tx.execute("SELECT api_key FROM users WHERE user_id=?", (user_id,)).fetchone()
+            return row["api_key"] if row else None
+
+    def users_with_api_key(self):
+        with self.transaction() as tx:
+            return [r["user_id"] for r in tx.execute(
+                "SELECT user_id FROM users WHERE api_key IS NOT NULL AND api_key != ''")]
+
+    # ------------------------------------------------------------ favorites
+
+    def add_favorite(self, user_id, item_id):
+        with self.transaction() as tx:
+            tx.execute("INSERT INTO favorites (user_id,item_id) VALUES (?,?) ON CONFLICT DO NOTHING",
+                       (user_id, item_id))
+
+    def remove_favorite(self, user_id, item_id):
+        with self.transaction() as tx:
+            tx.execute("DELETE FROM favorites WHERE user_id=? AND item_id=?", (user_id, item_id))
+
+    def list_favorites(self, user_id):
+        with self.transaction() as tx:
+            return [r["item_id"] for r in tx.execute("SELECT item_id FROM favorites WHERE user_id=?", (user_id,))]
+
+    # Everything the favorites page shows, for all of a user's favorites, in one query.
+    # Every branch is an index lookup: favorites PK, items/item_prices PK,
+    # daily_item_volume PK (item_id, snapshot_date), open_orders(user_id, item_id).
+    WATCHLIST_SQL = """
+    SELECT f.item_id,
+           i.name,
+           p.buy, p.sell, p.buy_qty, p.sell_qty, p.updated_at,
+           (SELECT {history} FROM (
+              SELECT snapshot_date, volume FROM daily_item_volume v
+              WHERE v.item_id = f.item_id
+              ORDER BY snapshot_date DESC LIMIT 7) h) AS volume_history,
+           COALESCE(e.buy_locked, 0)   AS buy_locked,
+           COALESCE(e.sell_locked, 0)  AS sell_locked,
+           COALESCE(e.stock_listed, 0) AS stock_listed
+    FROM favorites f
+    LEFT JOIN items i       ON i.item_id = f.item_id
+    LEFT JOIN item_prices p ON p.item_id = f.item_id
+    LEFT JOIN (SELECT item_id,   -- CASTs: Postgres sums BIGINT into NUMERIC
+                      CAST(SUM(CASE WHEN side='buy'  THEN unit_price*quantity_open ELSE 0 END) AS BIGINT) AS buy_locked,
+                      CAST(SUM(CASE WHEN side='sell' THEN unit_price*quantity_open ELSE 0 END) AS BIGINT) AS sell_locked,
+                      CAST(SUM(CASE WHEN side='sell' THEN quantity_open ELSE 0 END) AS BIGINT)            AS stock_listed
+               FROM open_orders WHERE user_id = ? GROUP BY item_id) e ON e.item_id = f.item_id
+    WHERE f.user_id = ?
+    ORDER BY f.created_at, f.item_id
+    """
+
+    # Cheap fingerprint of every input above; used as the ETag so repeat polls skip the query
+    VERSION_SQL = """
+    SELECT (SELECT COUNT(*) || ':' || COALESCE(MAX(created_at), '') FROM favorites WHERE user_id = ?) AS favorites,
+           (SELECT COUNT(*) || ':' || COALESCE(MAX(updated_at), '') FROM open_orders WHERE user_id = ?) AS orders,
+           (SELECT MAX(updated_at) FROM item_prices) AS prices,
+           (SELECT MAX(snapshot_date) FROM daily_item_volume) AS volumes,
+           (SELECT COUNT(*) FROM items) AS items
+    """
+
+    def watchlist_rows(self, user_id):
+        """Watchlist rows as dicts; volume_history is [[date, volume], ...] newest first."""
+        with self.transaction() as tx:
+            rows = tx.execute(self.WATCHLIST_SQL.format(history=self.HISTORY_AGG), (user_id, user_id)).fetchall()
+        out = []
+        for r in rows:
+            r = dict(r)
+            hist = r["volume_history"]
+            r["volume_history"] = json.loads(hist) if isinstance(hist, str) else (hist or [])
+            out.append(r)
+        return out
+
+    def watchlist_version(self, user_id):
+        with self.transaction() as tx:
+            return '|'.join(str(v) for v in tx.execute(self.VERSION_SQL, (user_id, user_id)).fetchone())
+
+    # ------------------------------------------------------------ items / market snapshots
+
+    def item_names(self, item_ids):
         ids = list(item_ids)
-        for i in range(0, len(ids), 200):
-            chunk = ids[i:i+200]
-            prices = fetch_prices_fn(chunk)
-            for entry in prices:
-                key = {"item_id": entry["id"], "snapshot_date": today}
-                existing = s.get(DailyItemVolume, (key["item_id"], key["snapshot_date"]))
-                if existing: existing.volume = entry.get("volume", 0)
-                else:        s.add(DailyItemVolume(volume=entry.get("volume", 0), **key))
-        s.commit()"""
+        names = {}
+        with self.transaction() as tx:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i+500]
+                q = f"SELECT item_id, name FROM items WHERE item_id IN ({','.join('?' for _ in chunk)})"
+                names.update((r["item_id"], r["name"]) for r in tx.execute(q, chunk))
+        return names
+
+    def save_item_names(self, names):
+        with self.transaction() as tx:
+            tx.upsert_rows('items', [{'item_id': i, 'name': n} for i, n in names.items()], key=('item_id',))
+
+    def save_market_snapshot(self, snapshot_date, grand_copper, prices, now):
+        """Daily account value, plus today's volume and latest prices for every entry of /v2/commerce/prices."""
+        with self.transaction() as tx:
+            tx.upsert_rows('daily_snapshots', [{'snapshot_date': snapshot_date, 'grand_copper': grand_copper}],
+                           key=('snapshot_date',))
+            self._save_prices(tx, snapshot_date, prices, now)
+
+    def save_prices(self, snapshot_date, prices, now):
+        """Today's volume and latest prices only, without touching the account value."""
+        with self.transaction() as tx:
+            self._save_prices(tx, snapshot_date, prices, now)
+
+    @staticmethod
+    def _save_prices(tx, snapshot_date, prices, now):
+        tx.upsert_rows('daily_item_volume', [
+            {'item_id': e['id'], 'snapshot_date': snapshot_date, 'volume': e.get('volume', 0)}
+            for e in prices], key=('item_id', 'snapshot_date'))
+        tx.upsert_rows('item_prices', [
+            {'item_id': e['id'], 'buy': e['buys']['unit_price'], 'sell': e['sells']['unit_price'],
+             'buy_qty': e['buys']['quantity'], 'sell_qty': e['sells']['quantity'], 'updated_at': now}
+            for e in prices], key=('item_id',))
+
+    def recent_snapshots(self, days=7):
+        """[(snapshot_date, gold)] newest first."""
+        with self.transaction() as tx:
+            return [(r["snapshot_date"], float(r["gold"])) for r in tx.execute("""
+              SELECT snapshot_date, grand_copper/10000.0 AS gold
+              FROM daily_snapshots
+              ORDER BY snapshot_date DESC
+              LIMIT ?
+            """, (days,))]
+
+    def volume_history(self, item_ids, limit=7):
+        """[(item_id, snapshot_date, volume)] ordered by item, newest first; `limit` days per item."""
+        ids = list(item_ids)
+        if not ids:
+            return []
+        with self.transaction() as tx:
+            return [(r["item_id"], r["snapshot_date"], r["volume"]) for r in tx.execute(f"""
+              SELECT item_id, snapshot_date, volume FROM (
+                SELECT item_id, snapshot_date, volume,
+                       ROW_NUMBER() OVER (PARTITION BY item_id ORDER BY snapshot_date DESC) AS rn
+                FROM daily_item_volume
+                WHERE item_id IN ({','.join('?' for _ in ids)})
+              ) t
+              WHERE rn <= ?
+              ORDER BY item_id, snapshot_date DESC
+            """, (*ids, limit))]
+
+    # ------------------------------------------------------------ orders
+
+    OPEN_ORDER_COLUMNS = "user_id, order_id, item_id, side, unit_price, quantity_open, listing_fee"
+
+    def open_orders(self, user_id=None):
+        """Open orders as dicts; all users' orders are streamed rather than fetched at once."""
+        q = f"SELECT {self.OPEN_ORDER_COLUMNS} FROM open_orders"
+        if user_id is None:
+            return [dict(r) for r in self.stream(q)]
+        with self.transaction() as tx:
+            return [dict(r) for r in tx.execute(q + " WHERE user_id=?", (user_id,))]
+
+    # sort key -> expression; each has an index (user_id, side, expr, order_id) in models.INDEXES
+    ORDER_SORTS = {
+        'item': 'o.item_id',
+        'price': 'o.unit_price',
+        'age': 'o.created_at',
+        'capital': '(o.unit_price * o.quantity_open)',
+    }
+
+    def orders_page(self, user_id, side, sort, desc, after=None, limit=100, name=None):
+        """
+        One page of a user's open orders on one side, keyset-paginated: `after` is the
+        (sort value, order_id) of the last row of the previous page, so every page is
+        an index range scan no matter how deep it is. Rows carry 'sort_value' for the
+        next cursor. With no `after` also returns the count and capital of all matches.
+        """
+        expr = self.ORDER_SORTS[sort]
+        where, params = "o.user_id=? AND o.side=?", [user_id, side]
+        if name:
+            where += " AND o.item_id IN (SELECT item_id FROM items WHERE lower(name) LIKE ?)"
+            params.append(f"%{name.lower()}%")
+        seek, seek_params = "", []
+        if after is not None:
+            # (expr, order_id) < (v, id), spelled out: SQLite won't seek an expression
+            # index on a row-value comparison, but does on the leading expr <= v
+            op = '<' if desc else '>'
+            seek = f" AND {expr} {op}= ? AND ({expr} {op} ? OR o.order_id {op} ?)"
+            seek_params = [after[0], after[0], after[1]]
+        direction = "DESC" if desc else "ASC"
+        with self.transaction() as tx:
+            rows = [dict(r) for r in tx.execute(f"""
+                SELECT o.order_id, o.item_id, i.name, o.unit_price, o.quantity_open, o.quantity_total,
+                       o.unit_price * o.quantity_open AS capital, o.created_at, {expr} AS sort_value
+                FROM open_orders o LEFT JOIN items i ON i.item_id = o.item_id
+                WHERE {where}{seek}
+                ORDER BY {expr} {direction}, o.order_id {direction}
+                LIMIT ?
+            """, (*params, *seek_params, limit))]
+            totals = None
+            if after is None:
+                count, capital = tx.execute(
+                    f"SELECT COUNT(*), CAST(COALESCE(SUM(o.unit_price * o.quantity_open), 0) AS BIGINT) "
+                    f"FROM open_orders o WHERE {where}", params).fetchone()
+                totals = {'total': count, 'capital': capital}
+        return rows, totals
+
+    def apply_order_diff(self, user_id, diff):
+        """
+        Read the user's open orders, let diff(prev) decide what changed and write it,
+        all under the user's lock. diff returns
+        {'orders': [row], 'fills': [row], 'events': [row], 'closed': [order_id]}
+        (rows are column dicts; 'orders' rows are upserted on (user_id, order_id)).
+        """
+        with self.transaction(lock=f"open_orders:{user_id}") as tx:
+            prev = {
+                r["order_id"]: dict(r)
+                for r in tx.execute(
+                    "SELECT order_id, item_id, side, unit_price, quantity_total, quantity_open "
+                    "FROM open_orders WHERE user_id=?",
+                    (user_id,),
+                )
+            }
+            changes = diff(prev)
+            # listing_fee and created_at are fixed when the order is first seen
+            tx.upsert_rows('open_orders', changes['orders'], key=('user_id', 'order_id'),
+                           update=('item_id', 'side', 'unit_price', 'quantity_total', 'quantity_open',
+                                   'updated_at', 'last_seen_poll'))
+            tx.insert_rows('fills', changes['fills'])
+            tx.executemany("DELETE FROM open_orders WHERE user_id=? AND order_id=?",
+                           [(user_id, oid) for oid in changes['closed']])
+            if changes['events']:
+                # seq must become visible in order, or an offset consumer could skip
+                # a lower seq that commits after a higher one
+                tx.lock('order_events')
+                tx.insert_rows('order_events', changes['events'])
+
+    def order_events(self, user_id, after, limit):
+        with self.transaction() as tx:
+            return [dict(r) for r in tx.execute(
+                "SELECT * FROM order_events WHERE user_id=? AND seq>? ORDER BY seq LIMIT ?",
+                (user_id, after, limit),
+            )]
+
+
+class Tx:
+    """A transaction: execute/executemany plus the bulk helpers repository code uses."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if rows:
+            self.conn.executemany(sql, rows)
+
+    def lock(self, key):
+        """Serialize with other transactions holding `key` until commit."""
+        raise NotImplementedError
+
+    def create_table(self, ddl):
+        self.execute(ddl)
+
+    def insert_rows(self, table, rows):
+        """Append many rows (dicts with the same keys)."""
+        if rows:
+            cols = list(rows[0])
+            self.executemany(f"INSERT INTO {table}({','.join(cols)}) VALUES({','.join('?' for _ in cols)})",
+                             [tuple(r[c] for c in cols) for r in rows])
+
+    def upsert_rows(self, table, rows, key, update=None):
+        """Insert many rows, updating `update` columns (default: all non-key) on key conflict."""
+        if rows:
+            cols = list(rows[0])
+            update = update or [c for c in cols if c not in key]
+            self.executemany(f"""
+              INSERT INTO {table}({','.join(cols)}) VALUES({','.join('?' for _ in cols)})
+              ON CONFLICT({','.join(key)}) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in update)}
+            """, [tuple(r[c] for c in cols) for r in rows])
+
+
+class SqliteTx(Tx):
+
+    def lock(self, key):
+        # transaction(lock=...) already took the database-wide write lock;
+        # otherwise take it now (a no-op once this transaction has written)
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+
+class SqliteRepository(Repository):
+
+    HISTORY_AGG = "json_group_array(json_array(snapshot_date, volume))"
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # generous busy timeout: several web workers may write the same file
+        c = sqlite3.connect(self.path, timeout=30)
+        c.row_factory = sqlite3.Row
+        # SQLite foreign keys are OFF by default; leave off so we don't block inserts
+        return c
+
+    @contextmanager
+    def transaction(self, lock=None):
+        conn = self.connect()
+        try:
+            if lock is not None:
+                # one writer at a time for the whole file: take the lock before
+                # reading, so concurrent writers diff against each other's result
+                conn.execute("BEGIN IMMEDIATE")
+            yield SqliteTx(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def stream(self, sql, params=(), size=STREAM_BATCH):
+        conn = self.connect()
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            conn.close()
+
+    def ensure_schema(self):
+        with self.transaction() as tx:
+            # WAL lets readers in other worker processes run while one writes
+            tx.execute("PRAGMA journal_mode=WAL")
+        super().ensure_schema()
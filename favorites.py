@@ -1,16 +1,44 @@
-from db import _conn, ensure_tables
+from db import ensure_tables, get_repo
+from indicators import net_sell
+
 def add_fav(user_id, item_id):
     ensure_tables()
-    with _conn() as c:
-        c.execute("INSERT OR IGNORE INTO favorites (user_id,item_id) VALUES (?,?)", (user_id, item_id))
-        c.commit()
+    get_repo().add_favorite(user_id, item_id)
 
 def remove_fav(user_id, item_id):
-    with _conn() as c:
-        c.execute("DELETE FROM favorites WHERE user_id=? AND item_id=?", (user_id, item_id))
-        c.commit()
+    get_repo().remove_favorite(user_id, item_id)
 
 def list_favs(user_id):
-    with _conn() as c:
-        return [r[0] for r in c.execute("SELECT item_id FROM favorites WHERE user_id=?", (user_id,))]
+    return get_repo().list_favorites(user_id)
+
+# ETag source for the watchlist: changes whenever any of its inputs do
+def watchlist_version(user_id):
+    return get_repo().watchlist_version(user_id)
 
+def watchlist(user_id, fill_probs=None):
+    """
+    Rows for the favorites page. fill_probs(item_ids) -> [probability or None]
+    (from the fill-model store) is applied to all rows at once; everything else is SQL.
+    volume_history is [[date, volume], ...] oldest first.
+    """
+    rows = get_repo().watchlist_rows(user_id)
+    probs = fill_probs([r["item_id"] for r in rows]) if fill_probs else [None] * len(rows)
+    out = []
+    for r, prob in zip(rows, probs):
+        buy, sell = r["buy"], r["sell"]
+        out.append({
+            'item_id': r["item_id"],
+            'name': r["name"] or f"#{r['item_id']}",
+            'buy': buy,
+            'sell': sell,
+            'buy_qty': r["buy_qty"],
+            'sell_qty': r["sell_qty"],
+            'prices_at': r["updated_at"],
+            'spread_net': round(net_sell(sell) - buy) if buy and sell else None,
+            'volume_history': r["volume_history"][::-1],
+            'fill_prob': prob,
+            'buy_locked': r["buy_locked"],
+            'sell_locked': r["sell_locked"],
+            'stock_listed': r["stock_listed"],
+        })
+    return out
@@ -2,7 +2,9 @@
 fetch_transaction_history.py
 
 Fetches your completed buy/sell transaction history from GW2 API
-and saves it to CSV files with proper timestamps.
+(every page of it) and saves it to CSV files with proper timestamps.
+Fetches are resumable (crawl.py): if one stops partway, running the script
+again within the hour fetches only the pages still missing.
 
 Usage:
 1. Make sure your .env file has GW2_KEY set
@@ -10,11 +12,12 @@ Usage:
 3. Gets you dated CSV files in data/buy_orders and data/sell_orders
 """
 
-import requests
 import csv
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from crawl import fetch_ids, fetch_pages
 
 load_dotenv()
 
@@ -22,7 +25,6 @@ API_KEY = os.getenv('GW2_KEY')
 if not API_KEY:
     raise RuntimeError('GW2_KEY not set in .env file')
 
-BASE_URL = 'https://api.guildwars2.com/v2'
 HEADERS = {'Authorization': f'Bearer {API_KEY}'}
 
 
@@ -31,31 +33,17 @@ def fetch_transaction_history(transaction_type):
     Fetch completed transactions from GW2 API.
     transaction_type: 'buys' or 'sells'
     """
-    url = f'{BASE_URL}/commerce/transactions/history/{transaction_type}'
-    response = requests.get(url, headers=HEADERS, timeout=10)
-    response.raise_for_status()
-    return response.json()
+    rows = fetch_pages(f'commerce/transactions/history/{transaction_type}',
+                       name=f'history:{transaction_type}', headers=HEADERS, max_age=3600)
+    # pages shift while new transactions come in; one row may appear on two
+    return list({t['id']: t for t in rows}.values())
 
 
 def fetch_item_names(item_ids):
     """
     Bulk fetch item names from GW2 API.
     """
-    names = {}
-    ids = list(item_ids)
-    
-    # API allows max 200 IDs per request
-    for i in range(0, len(ids), 200):
-        chunk = ids[i:i+200]
-        ids_str = ','.join(map(str, chunk))
-        url = f'{BASE_URL}/items?ids={ids_str}'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        for item in response.json():
-            names[item['id']] = item['name']
-    
-    return names
+    return {item['id']: item['name'] for item in fetch_ids('items', sorted(item_ids))}
 
 
 def save_to_csv(transactions, filename):
@@ -123,7 +111,7 @@ def main():
     print("\nDone! You now have:")
     print(f"  - {buy_filepath}")
     print(f"  - {sell_filepath}")
-    print("\nThese files contain  last 50 completed transactions per type")
+    print("\nThese files contain every completed transaction the API still lists (90 days)")
     print("with timestamps showing when orders were placed and when they filled.")
     print("\nRun this daily to accumulate historical data!")
 
@@ -4,11 +4,10 @@ Created on Mon Dec 15 10:51:42 2025
 
 @author: filip
 """
-import numpy as np
 import pandas as pd
-buy_data_path = 'data/buy_history_buy_history_2025-09-16_to_2025-12-15.csv'
-sell_data_path = "data/sell_orders/sell_history_2025-09-16_to_2025-12-15.csv"
+from analytics_export import load_table
 
-buys = pd.read_csv(buy_data_path)
-sells = pd.read_csv(sell_data_path)
+# typed + memory-mapped; run `python analytics_export.py export` after new CSVs land
+buys = load_table('transactions', filters=[('side', '=', 'buy')])
+sells = load_table('transactions', filters=[('side', '=', 'sell')])
 buys.head()
\ No newline at end of file
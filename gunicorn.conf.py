@@ -0,0 +1,28 @@
+# gunicorn.conf.py — multi-worker serving for tp.py (gunicorn -c gunicorn.conf.py wsgi:app)
+#
+# gthread workers: each process runs WEB_THREADS request threads, so a slow
+# upstream GW2 call only parks one thread instead of the whole app. SQLite is
+# opened per request in WAL mode, so workers don't share connections.
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '127.0.0.1:8000')
+# a loopback bind means a reverse proxy in front: trust its X-Forwarded-For (tp.py's
+# ProxyFix); bound to a public address, nothing forwarded is trusted
+os.environ.setdefault('TP_PROXY_HOPS', '1' if bind.startswith(('127.0.0.1:', 'localhost:', 'unix:')) else '0')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+# GW2 API calls time out after 10 s each; / makes several in a row
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# recycle workers now and then so a leak can't grow forever
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = os.getenv('ACCESS_LOG')  # '-' for stdout, unset = off
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
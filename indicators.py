@@ -0,0 +1,200 @@
+"""
+indicators.py
+
+Per-item market indicators maintained online from /v2/commerce/prices snapshots.
+Each snapshot updates every item it contains in O(1) (one vectorized pass), so
+nothing ever rescans price history:
+- EWMA buy/sell price (time-aware, half-life in hours)
+- rolling volatility: EWMA variance of log returns of the mid price
+- spread after fees: ewma_sell * (1 - 5% listing - 10% exchange) - ewma_buy
+- velocity: EWMA of listed quantity drawn down per hour (buys + sells filled)
+
+State is a handful of NumPy arrays indexed directly by item_id and persisted to
+data/indicators.npz between runs.
+
+Usage:
+    python indicators.py            # fetch a full-market snapshot and update
+    from indicators import load; load().frame()   # whole market in one call
+"""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from crawl import fetch_ids, get_json
+
+STATE_PATH = 'data/indicators.npz'
+
+LISTING_FEE = 0.05   # paid on sell placement
+EXCHANGE_FEE = 0.10  # paid on sell fill
+NET_SELL = 1 - LISTING_FEE - EXCHANGE_FEE
+
+HALF_LIFE_HOURS = 24.0
+
+# name -> dtype; every array is indexed by item_id
+FIELDS = {
+    'last_ts':    np.float64,  # epoch seconds of last update, 0 = never seen
+    'n_obs':      np.int32,
+    'buy':        np.int64,    # last highest buy order (copper)
+    'sell':       np.int64,    # last lowest sell listing (copper)
+    'buy_qty':    np.int64,
+    'sell_qty':   np.int64,
+    'ewma_buy':   np.float64,
+    'ewma_sell':  np.float64,
+    'ewvar_ret':  np.float64,  # EWMA variance of log mid returns
+    'velocity':   np.float64,  # units/hour
+}
+
+
+def net_sell(price):
+    """What a sell listing at `price` actually pays out after TP fees."""
+    return price * NET_SELL
+
+
+class IndicatorState:
+    def __init__(self, arrays=None, half_life_hours=HALF_LIFE_HOURS):
+        self.half_life_hours = half_life_hours
+        self.a = arrays or {k: np.zeros(0, dtype=t) for k, t in FIELDS.items()}
+
+    def __len__(self):
+        return len(self.a['last_ts'])
+
+    def _grow(self, max_id):
+        if max_id < len(self):
+            return
+        size = max(max_id + 1, int(len(self) * 1.5))
+        for k, arr in self.a.items():
+            grown = np.zeros(size, dtype=arr.dtype)
+            grown[:len(arr)] = arr
+            self.a[k] = grown
+
+    def update(self, prices, ts=None):
+        """
+        Fold one snapshot into the state.
+        prices: /v2/commerce/prices entries ({'id', 'buys': {...}, 'sells': {...}})
+        ts: snapshot time (epoch seconds), defaults to now
+        """
+        if not prices:
+            return 0
+        ts = time.time() if ts is None else ts
+        ids = np.fromiter((p['id'] for p in prices), dtype=np.int64, count=len(prices))
+        buy = np.fromiter((p['buys']['unit_price'] for p in prices), dtype=np.int64, count=len(prices))
+        sell = np.fromiter((p['sells']['unit_price'] for p in prices), dtype=np.int64, count=len(prices))
+        bq = np.fromiter((p['buys']['quantity'] for p in prices), dtype=np.int64, count=len(prices))
+        sq = np.fromiter((p['sells']['quantity'] for p in prices), dtype=np.int64, count=len(prices))
+        self._grow(int(ids.max()))
+        a = self.a
+
+        seen = a['n_obs'][ids] > 0
+        dt_h = np.where(seen, (ts - a['last_ts'][ids]) / 3600.0, 0.0)
+        dt_h = np.maximum(dt_h, 0.0)
+        # time-aware decay: weight of the old value after dt hours
+        keep = np.where(seen, 0.5 ** (dt_h / self.half_life_hours), 0.0)
+
+        # a price of 0 means that side of the book is empty: it isn't folded into
+        # that side's EWMA (which starts at the first real price), and there is no mid
+        keep_buy = np.where(buy > 0, np.where(a['ewma_buy'][ids] > 0, keep, 0.0), 1.0)
+        keep_sell = np.where(sell > 0, np.where(a['ewma_sell'][ids] > 0, keep, 0.0), 1.0)
+
+        # log return of the mid price; only when both books are two-sided
+        old_mid = (a['buy'][ids] + a['sell'][ids]) / 2.0
+        new_mid = (buy + sell) / 2.0
+        has_ret = seen & (a['buy'][ids] > 0) & (a['sell'][ids] > 0) & (buy > 0) & (sell > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret = np.where(has_ret, np.log(new_mid / old_mid), 0.0)
+        # no return, no volatility update (first sight still starts it at 0)
+        keep_var = np.where(has_ret | ~seen, keep, 1.0)
+
+        # drawdown of listed quantity = units that traded (ignores relists/cancels)
+        drawn = np.maximum(a['buy_qty'][ids] - bq, 0) + np.maximum(a['sell_qty'][ids] - sq, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(seen & (dt_h > 0), drawn / dt_h, 0.0)
+
+        a['ewma_buy'][ids] = keep_buy * a['ewma_buy'][ids] + (1 - keep_buy) * buy
+        a['ewma_sell'][ids] = keep_sell * a['ewma_sell'][ids] + (1 - keep_sell) * sell
+        a['ewvar_ret'][ids] = keep_var * a['ewvar_ret'][ids] + (1 - keep_var) * ret ** 2
+        # velocity only moves once we have an interval to measure over
+        vel_keep = np.where(dt_h > 0, keep, 1.0)
+        a['velocity'][ids] = vel_keep * a['velocity'][ids] + (1 - vel_keep) * rate
+
+        a['buy'][ids] = buy
+        a['sell'][ids] = sell
+        a['buy_qty'][ids] = bq
+        a['sell_qty'][ids] = sq
+        a['last_ts'][ids] = ts
+        a['n_obs'][ids] += 1
+        return len(ids)
+
+    def item_ids(self):
+        return np.flatnonzero(self.a['n_obs'])
+
+    def frame(self, item_ids=None):
+        """Indicators for the given items (default: every item ever seen) as a DataFrame."""
+        ids = self.item_ids() if item_ids is None else np.asarray(item_ids, dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self))]
+        a = self.a
+        df = pd.DataFrame({
+            'item_id': ids,
+            'buy': a['buy'][ids],
+            'sell': a['sell'][ids],
+            'ewma_buy': a['ewma_buy'][ids],
+            'ewma_sell': a['ewma_sell'][ids],
+            'volatility': np.sqrt(a['ewvar_ret'][ids]),
+            'spread_net': net_sell(a['ewma_sell'][ids]) - a['ewma_buy'][ids],
+            'velocity': a['velocity'][ids],
+            'n_obs': a['n_obs'][ids],
+            'last_ts': a['last_ts'][ids],
+        })
+        return df[df['n_obs'] > 0].set_index('item_id')
+
+    def save(self, path=STATE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, half_life_hours=self.half_life_hours, **self.a)
+        os.replace(tmp, path)
+
+
+def load(path=STATE_PATH):
+    """Load persisted state, or an empty one if nothing was saved yet."""
+    if not os.path.exists(path):
+        return IndicatorState()
+    with np.load(path) as z:
+        arrays = {k: z[k] for k in FIELDS}
+        return IndicatorState(arrays, float(z['half_life_hours']))
+
+
+_cache = {'mtime': None, 'state': None}
+
+
+def load_cached(path=STATE_PATH):
+    """load() for long-lived readers (web workers): re-reads only when the file changed."""
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if _cache['state'] is None or mtime != _cache['mtime']:
+        _cache['state'], _cache['mtime'] = load(path), mtime
+    return _cache['state']
+
+
+def fetch_market_prices(ids=None, chunk=200):
+    """
+    Full-market /v2/commerce/prices snapshot (public endpoint, no key needed).
+    Resumable (crawl.py): an interrupted run picks up where it stopped if rerun
+    within the hour; CrawlIncomplete carries the prices it did get.
+    """
+    if ids is None:
+        return fetch_ids('commerce/prices', lambda: get_json('commerce/prices'),
+                         name='commerce/prices:all', max_chunk=chunk, max_age=3600)
+    return fetch_ids('commerce/prices', ids, max_chunk=chunk, max_age=3600)
+
+
+def main():
+    state = load()
+    prices = fetch_market_prices()
+    n = state.update(prices)
+    state.save()
+    print(f"Updated indicators for {n} items ({len(state.item_ids())} tracked) -> {STATE_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+model_store.py
+
+Fill-model store keyed by item_id. One fixed-layout NumPy file
+(data/fill_models.npy) holds a record per possible item_id, so lookup is a
+plain array index. Readers memory-map it read-only: every web worker and the
+optimizer share the same page-cache copy instead of each parsing JSON.
+
+Writers build the whole array, save it next to the live file and os.replace()
+it in, so a reader only ever sees the old or the new version; open stores
+notice the new file on their next lookup (checked at most once a second).
+
+Usage:
+    python model_store.py build     # convert data/item_distributions.json (name-keyed)
+    from model_store import open_store
+    store = open_store(); store.get(24575)  -> (lambda_, rho_) or None
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+STORE_PATH = os.getenv('TP_MODEL_STORE', 'data/fill_models.npy')
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+RECORD = np.dtype([
+    ('lambda_', '<f8'),          # Weibull scale (hours)
+    ('rho_', '<f8'),             # Weibull shape
+    ('n_observations', '<i4'),   # 0 = no model for this item_id
+    ('quantiles', '<f4', (len(QUANTILES),)),  # fill hours at QUANTILES
+    ('fitted_at', '<i8'),        # epoch seconds
+])
+
+
+def weibull_quantiles(lambda_, rho_):
+    """Fill time (hours) by which each of QUANTILES of orders have filled."""
+    return [lambda_ * (-math.log(1 - q)) ** (1 / rho_) for q in QUANTILES]
+
+
+def write_store(models, path=STORE_PATH, fitted_at=None):
+    """
+    Atomically replace the store.
+    models: {item_id: {'lambda_', 'rho_', 'n_observations'[, 'fitted_at']}}
+    """
+    fitted_at = int(time.time() if fitted_at is None else fitted_at)
+    size = max(models) + 1 if models else 0
+    arr = np.zeros(size, dtype=RECORD)
+    for item_id, m in models.items():
+        rec = arr[item_id]
+        rec['lambda_'] = m['lambda_']
+        rec['rho_'] = m['rho_']
+        rec['n_observations'] = m['n_observations']
+        rec['quantiles'] = weibull_quantiles(m['lambda_'], m['rho_'])
+        rec['fitted_at'] = m.get('fitted_at', fitted_at)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(models)
+
+
+def build_from_json(json_path='data/item_distributions.json',
+                    catalogue_path='data/my_trading_items.csv', path=STORE_PATH):
+    """Convert the notebook's JSON; older name-only fits are mapped through the trading catalogue."""
+    with open(json_path) as f:
+        by_name = json.load(f)
+    catalogue = pd.read_csv(catalogue_path)
+    name_to_id = dict(zip(catalogue['item_name'], catalogue['item_id'].astype(int)))
+    fitted_at = os.path.getmtime(json_path)
+    models, unmapped = {}, []
+    for name, m in by_name.items():
+        if 'item_id' in m:  # newer fits carry their id
+            models[int(m['item_id'])] = m
+        elif name in name_to_id:
+            models[name_to_id[name]] = m
+        else:
+            unmapped.append(name)
+    n = write_store(models, path, fitted_at)
+    print(f"Saved {n} models to {path}")
+    if unmapped:
+        print(f"  no item_id for: {', '.join(unmapped)}")
+    return n
+
+
+class ModelStore:
+    """Read-only, memory-mapped view of the store. Mapping-like: store.get(item_id)."""
+
+    CHECK_EVERY = 1.0  # seconds between checks for a swapped-in file
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.arr = np.zeros(0, dtype=RECORD)
+        self._stat = None
+        self._checked = 0.0
+        self.refresh()
+
+    def refresh(self):
+        """Remap if a new file was swapped in; returns True when it did."""
+        self._checked = time.monotonic()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key == self._stat:
+            return False
+        self.arr = np.load(self.path, mmap_mode='r')
+        self._stat = key
+        return True
+
+    @property
+    def version(self):
+        """Changes whenever a new file is swapped in (None while there is no file)."""
+        return self._stat
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._checked >= self.CHECK_EVERY:
+            self.refresh()
+
+    def record(self, item_id):
+        """Full record (numpy.void) for item_id, or None."""
+        self._maybe_refresh()
+        arr = self.arr
+        if 0 <= item_id < len(arr) and arr['n_observations'][item_id] > 0:
+            return arr[item_id]
+        return None
+
+    def get(self, item_id, default=None):
+        """(lambda_, rho_) for item_id."""
+        rec = self.record(item_id)
+        if rec is None:
+            return default
+        return (float(rec['lambda_']), float(rec['rho_']))
+
+    def fill_probability(self, item_ids, horizon_hours):
+        """Weibull P(fill within horizon) for many items at once; None where there is no model."""
+        self._maybe_refresh()
+        ids = np.asarray(item_ids, dtype=np.int64)
+        ok = (ids >= 0) & (ids < len(self.arr))
+        recs = self.arr[ids[ok]]
+        found = np.zeros(len(ids), dtype=bool)
+        found[ok] = recs['n_observations'] > 0
+        lam = np.ones(len(ids))
+        rho = np.ones(len(ids))
+        lam[ok], rho[ok] = recs['lambda_'], recs['rho_']
+        lam[~found], rho[~found] = 1.0, 1.0  # empty slots are all zeros
+        p = 1 - np.exp(-((horizon_hours / lam) ** rho))
+        return [round(float(v), 4) if f else None for v, f in zip(p, found)]
+
+    def __contains__(self, item_id):
+        return self.record(item_id) is not None
+
+    def item_ids(self):
+        self._maybe_refresh()
+        return np.flatnonzero(self.arr['n_observations'])
+
+    def frame(self):
+        """Every stored model as a DataFrame indexed by item_id."""
+        ids = self.item_ids()
+        recs = self.arr[ids]
+        df = pd.DataFrame({
+            'lambda_': recs['lambda_'],
+            'rho_': recs['rho_'],
+            'n_observations': recs['n_observations'],
+            'fitted_at': pd.to_datetime(recs['fitted_at'], unit='s', utc=True),
+        }, index=pd.Index(ids, name='item_id'))
+        for j, q in enumerate(QUANTILES):
+            df[f'p{int(q * 100)}_fill_hours'] = recs['quantiles'][:, j]
+        return df
+
+
+_stores = {}
+
+
+def open_store(path=STORE_PATH):
+    """One shared ModelStore per path per process."""
+    if path not in _stores:
+        _stores[path] = ModelStore(path)
+    return _stores[path]
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['build']:
+        build_from_json()
+    else:
+        print(open_store().frame())
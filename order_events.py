@@ -0,0 +1,222 @@
+"""
+order_events.py
+
+Consumers of the append-only order_events log (written by
+orders.persist_current_orders). Each consumer keeps its own offset in
+event_offsets and only ever reads events with seq > offset; the derived rows
+and the new offset are committed in one transaction, so a crash never
+double-counts or skips an event. Replaying from seq 0 rebuilds a consumer's
+derived table from scratch.
+
+Event meanings (quantity / quantity_open / fee):
+- placed    listed qty / listed qty / 5% listing fee on sells
+- filled    qty filled since last poll / open qty left / 10% exchange fee on sells
+- repriced  open qty / open qty / 0
+- closed    qty still open when it vanished / 0 / 0  (cancelled, or filled out between polls)
+
+Usage:
+    python order_events.py run            # catch every consumer up
+    python order_events.py replay pnl     # drop + rebuild one consumer's table
+    python order_events.py status         # offsets and lag
+"""
+
+import sys
+from datetime import datetime
+
+from db import ensure_tables, get_repo
+
+BATCH = 5000
+
+
+def read_events(tx, after_seq, limit=BATCH):
+    return tx.execute(
+        "SELECT * FROM order_events WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+    ).fetchall()
+
+
+def get_offset(tx, name):
+    row = tx.execute("SELECT last_seq FROM event_offsets WHERE consumer=?", (name,)).fetchone()
+    return row["last_seq"] if row else 0
+
+
+def _set_offset(tx, name, seq):
+    tx.execute("""
+      INSERT INTO event_offsets(consumer, last_seq, updated_at) VALUES(?,?,?)
+      ON CONFLICT(consumer) DO UPDATE SET last_seq=excluded.last_seq, updated_at=excluded.updated_at
+    """, (name, seq, datetime.utcnow().isoformat(timespec="seconds")))
+
+
+class Consumer:
+    """Subclass with a name, create()/drop() for its table and apply() for a batch (given a db Tx)."""
+    name = None
+
+    def create(self, tx):
+        raise NotImplementedError
+
+    def drop(self, tx):
+        raise NotImplementedError
+
+    def apply(self, tx, events):
+        raise NotImplementedError
+
+
+class ItemPnl(Consumer):
+    """Running per-user, per-item realized flow: copper spent/earned, units and fees."""
+    name = "pnl"
+
+    def create(self, tx):
+        tx.create_table("""
+        CREATE TABLE IF NOT EXISTS item_pnl (
+          user_id       INTEGER NOT NULL,
+          item_id       INTEGER NOT NULL,
+          bought_qty    INTEGER NOT NULL DEFAULT 0,
+          bought_copper INTEGER NOT NULL DEFAULT 0,
+          sold_qty      INTEGER NOT NULL DEFAULT 0,
+          sold_copper   INTEGER NOT NULL DEFAULT 0,
+          fees_copper   INTEGER NOT NULL DEFAULT 0,   -- listing + exchange
+          PRIMARY KEY (user_id, item_id)
+        )""")
+
+    def drop(self, tx):
+        tx.execute("DROP TABLE IF EXISTS item_pnl")
+
+    def apply(self, tx, events):
+        rows = []
+        for e in events:
+            bq = bc = sq = sc = 0
+            if e["event"] == "filled":
+                if e["side"] == "buy":
+                    bq, bc = e["quantity"], e["quantity"] * e["unit_price"]
+                else:
+                    sq, sc = e["quantity"], e["quantity"] * e["unit_price"]
+            elif not e["fee"]:
+                continue
+            rows.append((e["user_id"], e["item_id"], bq, bc, sq, sc, e["fee"]))
+        tx.executemany("""
+          INSERT INTO item_pnl(user_id,item_id,bought_qty,bought_copper,sold_qty,sold_copper,fees_copper)
+          VALUES(?,?,?,?,?,?,?)
+          ON CONFLICT(user_id,item_id) DO UPDATE SET
+            bought_qty=item_pnl.bought_qty+excluded.bought_qty,
+            bought_copper=item_pnl.bought_copper+excluded.bought_copper,
+            sold_qty=item_pnl.sold_qty+excluded.sold_qty,
+            sold_copper=item_pnl.sold_copper+excluded.sold_copper,
+            fees_copper=item_pnl.fees_copper+excluded.fees_copper
+        """, rows)
+
+
+class OrderLifecycle(Consumer):
+    """
+    One row per order ever seen: placed/closed time, filled vs listed qty.
+    Orders closed with quantity left are right-censored observations for the
+    fill model (we only know they had not filled by closed_at).
+    """
+    name = "lifecycle"
+
+    def create(self, tx):
+        tx.create_table("""
+        CREATE TABLE IF NOT EXISTS order_lifecycle (
+          user_id        INTEGER NOT NULL,
+          order_id       INTEGER NOT NULL,
+          item_id        INTEGER NOT NULL,
+          side           TEXT NOT NULL,
+          first_price    INTEGER NOT NULL,
+          last_price     INTEGER NOT NULL,
+          quantity_total INTEGER NOT NULL,
+          quantity_filled INTEGER NOT NULL DEFAULT 0,
+          reprices       INTEGER NOT NULL DEFAULT 0,
+          placed_at      TEXT NOT NULL,
+          last_fill_at   TEXT,
+          closed_at      TEXT,
+          closed_open    INTEGER,            -- qty still open when it vanished
+          PRIMARY KEY (user_id, order_id)
+        )""")
+
+    def drop(self, tx):
+        tx.execute("DROP TABLE IF EXISTS order_lifecycle")
+
+    def apply(self, tx, events):
+        for e in events:
+            key = (e["user_id"], e["order_id"])
+            if e["event"] == "placed":
+                tx.execute("""
+                  INSERT INTO order_lifecycle(user_id,order_id,item_id,side,first_price,last_price,
+                                              quantity_total,placed_at)
+                  VALUES(?,?,?,?,?,?,?,?) ON CONFLICT DO NOTHING
+                """, (*key, e["item_id"], e["side"], e["unit_price"], e["unit_price"],
+                      e["quantity"], e["occurred_at"]))
+            elif e["event"] == "filled":
+                tx.execute("""
+                  UPDATE order_lifecycle SET quantity_filled=quantity_filled+?, last_fill_at=?
+                  WHERE user_id=? AND order_id=?
+                """, (e["quantity"], e["occurred_at"], *key))
+            elif e["event"] == "repriced":
+                tx.execute("""
+                  UPDATE order_lifecycle SET last_price=?, reprices=reprices+1
+                  WHERE user_id=? AND order_id=?
+                """, (e["unit_price"], *key))
+            elif e["event"] == "closed":
+                tx.execute("""
+                  UPDATE order_lifecycle SET closed_at=?, closed_open=?
+                  WHERE user_id=? AND order_id=?
+                """, (e["occurred_at"], e["quantity"], *key))
+
+
+CONSUMERS = {c.name: c for c in (ItemPnl(), OrderLifecycle())}
+
+
+def run_consumer(consumer, batch=BATCH):
+    """Process every event after the consumer's offset; returns how many were applied."""
+    ensure_tables()
+    total = 0
+    while True:
+        # the lock keeps two runners of the same consumer from applying a batch twice
+        with get_repo().transaction(lock=f"consumer:{consumer.name}") as tx:
+            consumer.create(tx)
+            offset = get_offset(tx, consumer.name)
+            events = read_events(tx, offset, batch)
+            if not events:
+                return total
+            consumer.apply(tx, events)
+            _set_offset(tx, consumer.name, events[-1]["seq"])
+        total += len(events)
+
+
+def run_all(batch=BATCH):
+    return {name: run_consumer(c, batch) for name, c in CONSUMERS.items()}
+
+
+def replay(consumer, batch=BATCH):
+    """Drop the consumer's derived table and rebuild it from the full log."""
+    ensure_tables()
+    with get_repo().transaction(lock=f"consumer:{consumer.name}") as tx:
+        consumer.drop(tx)
+        _set_offset(tx, consumer.name, 0)
+    return run_consumer(consumer, batch)
+
+
+def status():
+    ensure_tables()
+    with get_repo().transaction() as tx:
+        head = tx.execute("SELECT COALESCE(MAX(seq), 0) FROM order_events").fetchone()[0]
+        return {name: {'offset': get_offset(tx, name), 'lag': head - get_offset(tx, name)}
+                for name in CONSUMERS}
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if cmd == "run":
+        for name, n in run_all().items():
+            print(f"{name}: applied {n} events")
+    elif cmd == "replay":
+        names = sys.argv[2:] or list(CONSUMERS)
+        for name in names:
+            print(f"{name}: replayed {replay(CONSUMERS[name])} events")
+    elif cmd == "status":
+        for name, s in status().items():
+            print(f"{name}: offset {s['offset']}, lag {s['lag']}")
+    else:
+        sys.exit(f"unknown command {cmd!r} (run | replay [name...] | status)")
+
+
+if __name__ == "__main__":
+    main()
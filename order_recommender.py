@@ -0,0 +1,170 @@
+"""
+order_recommender.py
+
+Re-scores every row in open_orders against current prices, fill probabilities
+and TP fees, and recommends keep / reprice / cancel with the expected value
+(copper) of each action over a time horizon.
+
+EV per action, for q = quantity_open units:
+  sell  keep     q * (P(p)  * p  * 0.90 + (1 - P(p))  * bid * 0.85)
+        reprice  q * (P(p') * p' * 0.90 + (1 - P(p')) * bid * 0.85) - q * p' * 0.05   (new listing fee)
+        cancel   q * bid * 0.85                       (take items back, dump into best buy order)
+  buy   keep     q * P(p)  * (ask * 0.85 - p)
+        reprice  q * P(p') * (ask * 0.85 - p')
+        cancel   0                                    (coins come back, buy orders have no fee)
+where bid/ask are the current best buy/sell, p' is the new front-of-book price
+(ask - 1 for sells, bid + 1 for buys) and unfilled units at the horizon fall back
+to the instant-sell value. The 5% listing_fee recorded on a sell order is sunk:
+it is reported but never counted, since it is paid whatever we do now.
+
+Re-evaluation is incremental: an order is only recomputed when its own row or
+its item's prices/model changed since the previous pass.
+"""
+
+import math
+import threading
+import time
+
+from db import ensure_tables, get_repo
+from indicators import load_cached as load_indicators
+
+HORIZON_HOURS = 24
+
+# placeholder until the fill model is fitted per price level:
+# fill probability decays with how far we are behind the front of the book
+UNDERCUT_DECAY = 20.0  # exp(-20 * 5% gap) ~= 0.37
+
+# fallback when an item has no fitted model yet (roughly the median fit)
+DEFAULT_MODEL = (36.0, 1.5)  # (lambda_ hours, rho_)
+
+# indicator prices older than this aren't "current" (the indicator job stopped?)
+MAX_PRICE_AGE = 30 * 60  # seconds
+
+
+def fill_probability(lambda_, rho_, horizon_hours):
+    """Weibull CDF: P(order fills within horizon_hours)."""
+    return 1 - math.exp(-((horizon_hours / lambda_) ** rho_))
+
+
+def _competitiveness(side, price, bid, ask):
+    if side == 'sell':
+        gap = (price - ask) / ask if ask and price > ask else 0.0
+    else:
+        gap = (bid - price) / bid if bid and price < bid else 0.0
+    return math.exp(-UNDERCUT_DECAY * gap)
+
+
+def score_order(order, bid, ask, model, horizon_hours=HORIZON_HOURS):
+    """EV of keep / reprice / cancel for one open order row (dict-like)."""
+    side = order['side']
+    p = order['unit_price']
+    q = order['quantity_open']
+    p_front = fill_probability(*model, horizon_hours)
+
+    if side == 'sell':
+        new_price = max(ask - 1, 1) if ask else p
+        p_keep = p_front * _competitiveness(side, p, bid, ask)
+        dump = bid * 0.85
+        ev = {
+            'keep':    q * (p_keep * p * 0.90 + (1 - p_keep) * dump),
+            'reprice': q * (p_front * new_price * 0.90 + (1 - p_front) * dump) - q * new_price * 0.05,
+            'cancel':  q * dump,
+        }
+    else:
+        new_price = bid + 1 if bid else p
+        resale = ask * 0.85
+        p_keep = p_front * _competitiveness(side, p, bid, ask)
+        ev = {
+            'keep':    q * p_keep * (resale - p),
+            'reprice': q * p_front * (resale - new_price),
+            'cancel':  0.0,
+        }
+
+    # repricing to where we already are is just keeping
+    if new_price == p:
+        ev['reprice'] = ev['keep']
+    action = max(ev, key=lambda k: (ev[k], k == 'keep'))
+    return {
+        'order_id': order['order_id'],
+        'item_id': order['item_id'],
+        'side': side,
+        'unit_price': p,
+        'quantity_open': q,
+        'sunk_listing_fee': order['listing_fee'] if side == 'sell' else 0,
+        'bid': bid,
+        'ask': ask,
+        'new_price': new_price,
+        'fill_prob_keep': round(p_keep, 4),
+        'fill_prob_reprice': round(p_front, 4),
+        'ev': {k: round(v) for k, v in ev.items()},
+        'action': action,
+    }
+
+
+class OrderRecommender:
+    """
+    Keeps the last pass per order so unchanged orders/items are not re-scored.
+    Shared by a web worker's threads: evaluate() runs under `lock` (re-entrant, so
+    callers can hold it to read last_recomputed for their own pass).
+    """
+
+    def __init__(self, horizon_hours=HORIZON_HOURS):
+        self.horizon_hours = horizon_hours
+        self._results = {}    # (user_id, order_id) -> (row key incl. bid/ask/model, recommendation)
+        self.last_recomputed = 0
+        self.lock = threading.RLock()
+
+    def evaluate(self, orders, prices, models):
+        """
+        orders: open_orders rows (user_id, order_id, item_id, side, unit_price, quantity_open, listing_fee)
+        prices: {item_id: (bid, ask)} current best buy / best sell
+        models: {item_id: (lambda_, rho_)} or a model_store.ModelStore
+        """
+        item_keys = {}
+        for o in orders:
+            i = o['item_id']
+            if i not in item_keys:
+                bid, ask = prices.get(i, (0, 0))
+                item_keys[i] = (bid, ask, models.get(i, DEFAULT_MODEL))
+
+        with self.lock:
+            out, results, recomputed = [], {}, 0
+            for o in orders:
+                key = (o['user_id'], o['order_id'])
+                # each result remembers the prices/model it was scored with, so a
+                # pass of another user moving the item can't hide the change
+                row_key = (o['item_id'], o['side'], o['unit_price'], o['quantity_open'], item_keys[o['item_id']])
+                cached = self._results.get(key)
+                if cached and cached[0] == row_key:
+                    rec = cached[1]
+                else:
+                    bid, ask, model = item_keys[o['item_id']]
+                    rec = score_order(o, bid, ask, model, self.horizon_hours)
+                    recomputed += 1
+                results[key] = (row_key, rec)
+                out.append(rec)
+
+            # orders that vanished are dropped; other users' passes are kept
+            users = {o['user_id'] for o in orders}
+            self._results = {k: v for k, v in self._results.items() if k[0] not in users}
+            self._results.update(results)
+            self.last_recomputed = recomputed
+        return out
+
+
+def load_open_orders(user_id=None):
+    ensure_tables()
+    return get_repo().open_orders(user_id)
+
+
+def prices_from_indicators(item_ids, max_age=MAX_PRICE_AGE):
+    """
+    {item_id: (bid, ask)} from the latest snapshot folded into indicators.py.
+    Items not updated within max_age seconds are left out, like unknown ones:
+    callers fetch those live.
+    """
+    a = load_indicators().a
+    n = len(a['buy'])
+    cutoff = time.time() - max_age
+    return {i: (int(a['buy'][i]), int(a['sell'][i])) for i in item_ids
+            if i < n and a['n_obs'][i] and a['last_ts'][i] >= cutoff}
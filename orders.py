@@ -1,80 +1,107 @@
-from db import _conn, ensure_tables
+import base64
+import json
+from datetime import datetime
+from db import ensure_tables, get_repo
 
-def persist_current_orders(user_id: int, buys: list[dict], sells: list[dict]) -> None:
+def _event(user_id, oid, item, side, event, price, qty, qty_open, fee, now):
+    return {"user_id": user_id, "order_id": oid, "item_id": item, "side": side, "event": event,
+            "unit_price": price, "quantity": qty, "quantity_open": qty_open, "fee": fee, "occurred_at": now}
+
+def diff_orders(user_id: int, prev: dict, buys: list[dict], sells: list[dict], now: str) -> dict:
     """
-    Idempotent diff for one user:
-    - New sell orders record 5% listing fee on full qty (non-refundable).
-    - If quantity_open drops, insert a fill for the delta (10% exchange fee on sells).
-    - Orders that vanish are removed from open_orders (treated as closed between polls).
+    Compare one poll with the stored open orders (prev: order_id -> row) and
+    return the rows to write, see Repository.apply_order_diff.
     """
-    ensure_tables()
-    now = datetime.utcnow().isoformat(timespec="seconds")
     all_orders = [{**o, "side": "buy"} for o in buys] + [{**o, "side": "sell"} for o in sells]
+    orders, fills, events = [], [], []
+    seen = set()
 
-    with _conn() as conn:
-        cur = conn.cursor()
-
-        # previous state for this user
-        prev = {
-            r["order_id"]: dict(r)
-            for r in cur.execute(
-                "SELECT order_id, item_id, side, unit_price, quantity_total, quantity_open "
-                "FROM open_orders WHERE user_id=?",
-                (user_id,),
-            )
-        }
+    for o in all_orders:
+        oid = o["id"]; item = o["item_id"]; side = o["side"]
+        price = o["price"]; qty = o["quantity"]
+        created = o.get("created") or now
+        listing = 0
 
-        seen = set()
+        if oid in prev:
+            old_open = prev[oid]["quantity_open"]
+            new_open = qty
+            delta = max(0, old_open - new_open)
+            if delta > 0:
+                exh_fee = (price * delta * 10) // 100 if side == "sell" else 0
+                fills.append({"user_id": user_id, "order_id": oid, "item_id": item, "side": side,
+                              "quantity": delta, "unit_price": price, "occurred_at": now,
+                              "exchange_fee": exh_fee})
+                events.append(_event(user_id, oid, item, side, "filled", price, delta, new_open, exh_fee, now))
+            if price != prev[oid]["unit_price"]:
+                events.append(_event(user_id, oid, item, side, "repriced", price, new_open, new_open, 0, now))
+        else:
+            # new order: pay 5% listing fee on full qty for sells
+            listing = (price * qty * 5) // 100 if side == "sell" else 0
+            events.append(_event(user_id, oid, item, side, "placed", price, qty, qty, listing, now))
 
-        for o in all_orders:
-            oid = o["id"]; item = o["item_id"]; side = o["side"]
-            price = o["price"]; qty = o["quantity"]
-            created = o.get("created") or now
+        orders.append({"user_id": user_id, "order_id": oid, "item_id": item, "side": side,
+                       "unit_price": price, "quantity_total": qty, "quantity_open": qty,
+                       "listing_fee": listing, "created_at": created, "updated_at": now,
+                       "last_seen_poll": now})
+        seen.add(oid)
 
-            if oid in prev:
-                old_open = prev[oid]["quantity_open"]
-                new_open = qty
-                delta = max(0, old_open - new_open)
-                if delta > 0:
-                    exh_fee = (price * delta * 10) // 100 if side == "sell" else 0
-                    cur.execute(
-                        """INSERT INTO fills(user_id,order_id,item_id,side,quantity,unit_price,occurred_at,exchange_fee)
-                           VALUES(?,?,?,?,?,?,?,?)""",
-                        (user_id, oid, item, side, delta, price, now, exh_fee),
-                    )
+    # vanished open orders (cancelled, or filled out between polls)
+    closed = [oid for oid in prev if oid not in seen]
+    for oid in closed:
+        p = prev[oid]
+        events.append(_event(user_id, oid, p["item_id"], p["side"], "closed",
+                             p["unit_price"], p["quantity_open"], 0, 0, now))
 
-                # upsert open order
-                cur.execute("""
-                  INSERT INTO open_orders(user_id,order_id,item_id,side,unit_price,quantity_total,quantity_open,listing_fee,created_at,updated_at,last_seen_poll)
-                  VALUES(?,?,?,?,?,?,?,?,?,?,?)
-                  ON CONFLICT(user_id,order_id) DO UPDATE SET
-                    item_id=excluded.item_id,
-                    side=excluded.side,
-                    unit_price=excluded.unit_price,
-                    quantity_total=excluded.quantity_total,
-                    quantity_open=excluded.quantity_open,
-                    updated_at=excluded.updated_at,
-                    last_seen_poll=excluded.last_seen_poll
-                """, (user_id, oid, item, side, price, qty, qty, 0, created, now, now))
+    return {"orders": orders, "fills": fills, "events": events, "closed": closed}
 
-            else:
-                # new order: pay 5% listing fee on full qty for sells
-                listing = (price * qty * 5) // 100 if side == "sell" else 0
-                cur.execute("""
-                  INSERT INTO open_orders(user_id,order_id,item_id,side,unit_price,quantity_total,quantity_open,listing_fee,created_at,updated_at,last_seen_poll)
-                  VALUES(?,?,?,?,?,?,?,?,?,?,?)
-                """, (user_id, oid, item, side, price, qty, qty, listing, created, now, now))
+def persist_current_orders(user_id: int, buys: list[dict], sells: list[dict]) -> None:
+    """
+    Idempotent diff for one user:
+    - New sell orders record 5% listing fee on full qty (non-refundable).
+    - If quantity_open drops, insert a fill for the delta (10% exchange fee on sells).
+    - Orders that vanish are removed from open_orders (treated as closed between polls).
+    Every change is also appended to order_events in the same transaction
+    (placed / filled / repriced / closed), see order_events.py.
+    """
+    ensure_tables()
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    # the diff runs under the user's write lock, so concurrent polls of the
+    # same user (several web workers / poller workers) see each other's result
+    get_repo().apply_order_diff(user_id, lambda prev: diff_orders(user_id, prev, buys, sells, now))
 
-            seen.add(oid)
+PAGE_SORTS = ('item', 'price', 'age', 'capital')
 
-        # remove vanished open orders for this user
-        if seen:
-            q = f"SELECT order_id FROM open_orders WHERE user_id=? AND order_id NOT IN ({','.join('?' for _ in seen)})"
-            missing = cur.execute(q, (user_id, *seen)).fetchall()
-        else:
-            missing = cur.execute("SELECT order_id FROM open_orders WHERE user_id=?", (user_id,)).fetchall()
+def _cursor(row) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["sort_value"], row["order_id"]]).encode()).decode()
 
-        for r in missing:
-            cur.execute("DELETE FROM open_orders WHERE user_id=? AND order_id=?", (user_id, r["order_id"]))
+def _after(cursor: str):
+    try:
+        value, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("bad cursor")
+    if not isinstance(order_id, int) or not isinstance(value, (int, str)):
+        raise ValueError("bad cursor")
+    return value, order_id
 
-        conn.commit()
\ No newline at end of file
+def orders_page(user_id: int, side: str, sort: str = "capital", desc: bool = True,
+                cursor: str | None = None, limit: int = 100, name: str | None = None) -> dict:
+    """
+    One page of open orders for the dashboard tables. `next` is an opaque cursor for
+    the following page (None on the last one); the first page also has the total
+    count and capital of every matching order. Raises ValueError on bad arguments.
+    """
+    if side not in ("buy", "sell"):
+        raise ValueError(f"side must be buy or sell, not {side!r}")
+    if sort not in PAGE_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(PAGE_SORTS)}")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    after = _after(cursor) if cursor else None
+    rows, totals = get_repo().orders_page(user_id, side, sort, desc, after, limit + 1, name)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    page = {"orders": [{k: v for k, v in r.items() if k != "sort_value"} for r in rows],
+            "next": _cursor(rows[-1]) if more else None}
+    if totals:
+        page.update(totals)
+    return page
@@ -0,0 +1,319 @@
+"""
+poller.py
+
+Distributed poll mode for many accounts. A coordinator enqueues one poll job
+per user (with an API key) into a SQLite-backed job queue; N worker processes
+lease jobs and run the fetch_orders / persist_current_orders work for that user.
+
+Single host only: the queue is a SQLite file in WAL mode, and WAL needs every
+process on the same machine (shared memory); over a network filesystem leases
+could be handed out twice or the file corrupted. Coordinator and workers run on
+the host that holds TP_QUEUE_PATH (the app DB itself may be remote, DATABASE_URL).
+
+- Sharding: every job carries shard = hash(user_id) % SHARDS. Worker i of N
+  prefers shards s with s % N == i (keeps a user on the same worker, so its
+  HTTP connection stays warm), and steals from any shard when its own are empty.
+- Leases: a leased job must finish before lease_expires; the coordinator puts
+  expired leases back in the queue (the worker is assumed dead).
+- Retries: a failed job is re-queued with exponential backoff; after
+  MAX_ATTEMPTS it is dead-lettered (status='dead') and left for inspection.
+- Metrics: queue depth per status, throughput, lag of the oldest queued job,
+  mean job duration and per-worker counts (python poller.py metrics).
+
+Usage:
+    python poller.py coordinator --interval 180
+    python poller.py worker --processes 4 [--index 0 --of 2] [--drain]   # --of: worker groups on this host
+    python poller.py metrics
+    python poller.py requeue-dead
+"""
+
+import argparse
+import contextlib
+import hashlib
+import multiprocessing as mp
+import os
+import socket
+import sqlite3
+import time
+import traceback
+
+import requests
+
+import db
+from order_events import run_all as run_event_consumers
+from orders import persist_current_orders
+from users import get_api_key
+
+QUEUE_PATH = os.getenv("TP_QUEUE_PATH", "queue.sqlite")
+BASE = os.getenv('GW2_API_BASE', 'https://api.guildwars2.com/v2')
+
+SHARDS = 64
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 10      # seconds; retry n waits BACKOFF_BASE * 2**(n-1)
+KEEP_DONE_SECONDS = 24 * 3600
+
+
+def shard_of(user_id):
+    # stable across processes/hosts (Python's hash() is salted per process)
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=4).digest(), "big") % SHARDS
+
+
+@contextlib.contextmanager
+def _qconn(path=None):
+    # autocommit (transactions are explicit BEGIN IMMEDIATE); closed on exit, since
+    # workers open one per queue op for as long as they run
+    c = sqlite3.connect(path or QUEUE_PATH, timeout=30, isolation_level=None)
+    c.row_factory = sqlite3.Row
+    try:
+        yield c
+    finally:
+        c.close()
+
+
+def ensure_queue(path=None):
+    with _qconn(path) as c:
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS poll_jobs (
+          job_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id       INTEGER NOT NULL,
+          shard         INTEGER NOT NULL,
+          status        TEXT NOT NULL CHECK(status IN ('queued','leased','done','dead')),
+          attempts      INTEGER NOT NULL DEFAULT 0,
+          available_at  REAL NOT NULL,    -- epoch seconds; backoff pushes this out
+          enqueued_at   REAL NOT NULL,
+          leased_by     TEXT,
+          lease_expires REAL,
+          started_at    REAL,
+          finished_at   REAL,
+          last_error    TEXT
+        )""")
+        # at most one pending job per user, so a slow cycle can't pile up duplicates
+        c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS ux_poll_jobs_pending
+                     ON poll_jobs(user_id) WHERE status IN ('queued','leased')""")
+        c.execute("CREATE INDEX IF NOT EXISTS ix_poll_jobs_ready ON poll_jobs(status, shard, available_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS ix_poll_jobs_finished ON poll_jobs(status, finished_at)")
+
+
+# ---------------------------------------------------------------- queue ops
+
+def enqueue(user_ids, path=None):
+    """Queue a poll for each user that has no queued/leased job yet; returns how many were added."""
+    now = time.time()
+    with _qconn(path) as c:
+        c.execute("BEGIN IMMEDIATE")
+        before = c.total_changes
+        c.executemany("""
+          INSERT OR IGNORE INTO poll_jobs(user_id, shard, status, available_at, enqueued_at)
+          VALUES (?, ?, 'queued', ?, ?)
+        """, [(u, shard_of(u), now, now) for u in user_ids])
+        added = c.total_changes - before
+        c.execute("COMMIT")
+    return added
+
+
+def lease(worker, shards=None, lease_seconds=LEASE_SECONDS, path=None):
+    """Claim the next ready job, preferring `shards`; returns the row or None."""
+    now = time.time()
+    with _qconn(path) as c:
+        c.execute("BEGIN IMMEDIATE")
+        row = None
+        if shards:
+            q = (f"SELECT job_id FROM poll_jobs WHERE status='queued' AND available_at<=? "
+                 f"AND shard IN ({','.join('?' for _ in shards)}) ORDER BY available_at LIMIT 1")
+            row = c.execute(q, (now, *shards)).fetchone()
+        if row is None:  # nothing in our shards: steal
+            row = c.execute("SELECT job_id FROM poll_jobs WHERE status='queued' AND available_at<=? "
+                            "ORDER BY available_at LIMIT 1", (now,)).fetchone()
+        if row is None:
+            c.execute("COMMIT")
+            return None
+        c.execute("""
+          UPDATE poll_jobs SET status='leased', leased_by=?, lease_expires=?, started_at=?,
+                               attempts=attempts+1
+          WHERE job_id=?
+        """, (worker, now + lease_seconds, now, row["job_id"]))
+        job = c.execute("SELECT * FROM poll_jobs WHERE job_id=?", (row["job_id"],)).fetchone()
+        c.execute("COMMIT")
+    return dict(job)
+
+
+def complete(job, path=None):
+    with _qconn(path) as c:
+        c.execute("UPDATE poll_jobs SET status='done', finished_at=?, last_error=NULL "
+                  "WHERE job_id=? AND status='leased' AND leased_by=?",
+                  (time.time(), job["job_id"], job["leased_by"]))
+
+
+def fail(job, error, path=None):
+    """Retry with exponential backoff, or dead-letter once MAX_ATTEMPTS is reached."""
+    now = time.time()
+    with _qconn(path) as c:
+        if job["attempts"] >= MAX_ATTEMPTS:
+            c.execute("UPDATE poll_jobs SET status='dead', finished_at=?, last_error=? "
+                      "WHERE job_id=? AND leased_by=?", (now, error, job["job_id"], job["leased_by"]))
+        else:
+            delay = BACKOFF_BASE * 2 ** (job["attempts"] - 1)
+            c.execute("UPDATE poll_jobs SET status='queued', available_at=?, leased_by=NULL, "
+                      "lease_expires=NULL, last_error=? WHERE job_id=? AND leased_by=?",
+                      (now + delay, error, job["job_id"], job["leased_by"]))
+
+
+def reap_expired(path=None):
+    """Put jobs whose lease ran out back in the queue (or dead-letter them)."""
+    now = time.time()
+    with _qconn(path) as c:
+        c.execute("BEGIN IMMEDIATE")
+        dead = c.execute("""
+          UPDATE poll_jobs SET status='dead', finished_at=?, last_error='lease expired'
+          WHERE status='leased' AND lease_expires<? AND attempts>=?
+        """, (now, now, MAX_ATTEMPTS)).rowcount
+        requeued = c.execute("""
+          UPDATE poll_jobs SET status='queued', available_at=?, leased_by=NULL, lease_expires=NULL,
+                               last_error='lease expired'
+          WHERE status='leased' AND lease_expires<?
+        """, (now, now)).rowcount
+        c.execute("DELETE FROM poll_jobs WHERE status='done' AND finished_at<?", (now - KEEP_DONE_SECONDS,))
+        c.execute("COMMIT")
+    return requeued, dead
+
+
+def requeue_dead(path=None):
+    now = time.time()
+    with _qconn(path) as c:
+        return c.execute("""
+          UPDATE OR IGNORE poll_jobs SET status='queued', attempts=0, available_at=?, leased_by=NULL,
+                                         lease_expires=NULL
+          WHERE status='dead'
+        """, (now,)).rowcount
+
+
+def metrics(window=300, path=None):
+    now = time.time()
+    with _qconn(path) as c:
+        counts = dict(c.execute("SELECT status, COUNT(*) FROM poll_jobs GROUP BY status").fetchall())
+        oldest = c.execute("SELECT MIN(enqueued_at) FROM poll_jobs WHERE status='queued' AND available_at<=?",
+                           (now,)).fetchone()[0]
+        done = c.execute("""
+          SELECT COUNT(*), AVG(finished_at - started_at), AVG(finished_at - enqueued_at)
+          FROM poll_jobs WHERE status='done' AND finished_at>=?
+        """, (now - window,)).fetchone()
+        per_worker = dict(c.execute("""
+          SELECT leased_by, COUNT(*) FROM poll_jobs
+          WHERE status='done' AND finished_at>=? GROUP BY leased_by
+        """, (now - window,)).fetchall())
+    return {
+        'queued': counts.get('queued', 0),
+        'leased': counts.get('leased', 0),
+        'done': counts.get('done', 0),
+        'dead': counts.get('dead', 0),
+        'throughput_per_min': round(done[0] / window * 60, 2),
+        'lag_seconds': round(now - oldest, 1) if oldest else 0.0,
+        'mean_job_seconds': round(done[1], 3) if done[1] is not None else None,
+        'mean_latency_seconds': round(done[2], 3) if done[2] is not None else None,
+        'per_worker': per_worker,
+    }
+
+
+# ---------------------------------------------------------------- the work
+
+def poll_user(user_id, http):
+    """fetch_orders + persist_current_orders for one user, with that user's own key."""
+    key = get_api_key(user_id)
+    if not key:
+        raise RuntimeError(f"user {user_id} has no API key")
+    headers = {'Authorization': f'Bearer {key}'}
+    out = []
+    for side in ('buys', 'sells'):
+        resp = http.get(f"{BASE}/commerce/transactions/current/{side}", headers=headers, timeout=10)
+        resp.raise_for_status()
+        out.append(resp.json())
+    persist_current_orders(user_id, *out)
+    return sum(len(o) for o in out)
+
+
+def worker_loop(index, total, drain=False, idle_sleep=1.0, path=None):
+    """Lease and run jobs forever; with drain=True, return once nothing is ready."""
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    shards = [s for s in range(SHARDS) if s % total == index]
+    http = requests.Session()
+    handled = 0
+    while True:
+        job = lease(name, shards, path=path)
+        if job is None:
+            if drain:
+                return handled
+            time.sleep(idle_sleep)
+            continue
+        try:
+            poll_user(job["user_id"], http)
+        except Exception as e:
+            fail(job, f"{type(e).__name__}: {e}", path=path)
+            traceback.print_exc()
+        else:
+            complete(job, path=path)
+        handled += 1
+
+
+def run_workers(processes, index=0, of=1, drain=False, path=None):
+    """Start `processes` local workers; they form group `index` of `of` sharing the shards."""
+    ensure_queue(path)
+    total = processes * of
+    procs = [mp.Process(target=worker_loop, args=(index * processes + i, total),
+                        kwargs={'drain': drain, 'path': path})
+             for i in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+def active_users():
+    db.ensure_tables()
+    return db.get_repo().users_with_api_key()
+
+
+def coordinator(interval=180, path=None):
+    ensure_queue(path)
+    while True:
+        t0 = time.time()
+        requeued, dead = reap_expired(path)
+        added = enqueue(active_users(), path)
+        run_event_consumers()  # fold the last cycle's order events into derived tables
+        m = metrics(path=path)
+        print(f"enqueued {added}, requeued {requeued}, dead-lettered {dead} | "
+              f"queued {m['queued']} leased {m['leased']} dead {m['dead']} | "
+              f"{m['throughput_per_min']}/min, lag {m['lag_seconds']}s", flush=True)
+        time.sleep(max(0.0, interval - (time.time() - t0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded multi-process order poller')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    co = sub.add_parser('coordinator')
+    co.add_argument('--interval', type=float, default=180)
+    wk = sub.add_parser('worker')
+    wk.add_argument('--processes', type=int, default=os.cpu_count())
+    wk.add_argument('--index', type=int, default=0, help='this group\'s index among worker groups')
+    wk.add_argument('--of', type=int, default=1, help='number of worker groups (on this host)')
+    wk.add_argument('--drain', action='store_true', help='exit once the queue has nothing ready')
+    sub.add_parser('metrics')
+    sub.add_parser('requeue-dead')
+    args = parser.parse_args()
+
+    if args.cmd == 'coordinator':
+        coordinator(args.interval)
+    elif args.cmd == 'worker':
+        run_workers(args.processes, args.index, args.of, args.drain)
+    elif args.cmd == 'metrics':
+        ensure_queue()
+        for k, v in metrics().items():
+            print(f"{k}: {v}")
+    else:
+        ensure_queue()
+        print(f"requeued {requeue_dead()} dead jobs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,510 @@
+"""
+report.py
+
+Daily trading report (what Optimizer.ipynb's `daily_report = ...` was meant to be):
+
+    ingest -> fit -> score -> optimize -> render
+
+- ingest    transaction history CSVs; the user's open orders and realized P&L
+            (order_events 'pnl' consumer); current prices for the catalogue
+- fit       Weibull time-to-fill per item from the sell history (also written
+            to the model store the web app reads)
+- score     per catalogue item: margin after fees, P(fill within horizon) and
+            expected profit; per open order: keep / reprice / cancel
+- optimize  buy list under budget / max_transactions / min_margin / min_fill_prob
+- render    static JSON + HTML in data/reports/<user_id>/, named by content hash,
+            with latest.json pointing at the newest. The dashboard serves these
+            files as they are (/plan, /api/report); nothing is computed per request.
+
+Every stage is cached on its inputs: the cache key is a hash of the stage's
+version, its parameters and the content of its inputs, and the result is kept in
+data/reports/cache/. A stage whose inputs did not change is loaded instead of
+run, e.g. the fit only re-runs when new history CSVs land. Prices are fetched
+fresh on every run, so scoring onwards normally recomputes.
+
+Usage:
+    python report.py run [--user 1] [--force] [--budget 1000] [--horizon-days 1] ...
+    python report.py schedule --at 03:00     # once a day, every user with an API key
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import pickle
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from analytics_export import build_transactions
+from db import ensure_tables, get_repo
+from indicators import NET_SELL, fetch_market_prices
+from model_store import write_store
+from order_events import CONSUMERS, run_consumer
+from order_recommender import OrderRecommender, load_open_orders
+
+REPORT_DIR = 'data/reports'
+CACHE_DIR = os.path.join(REPORT_DIR, 'cache')
+CACHE_DAYS = 14      # unused cache entries older than this are pruned
+KEEP_DAYS = 30       # old report artifacts are pruned after this
+CATALOGUE_PATH = 'data/my_trading_items.csv'
+HISTORY_GLOBS = ('data/buy_orders/buy_history_*.csv', 'data/sell_orders/sell_history_*.csv')
+MIN_OBSERVATIONS = 3
+MAX_ORDER_QTY = 250  # TP limit per order
+
+# Optimizer.ipynb's optimizer() defaults
+DEFAULTS = {
+    'budget_gold': 1000,
+    'horizon_days': 1,
+    'min_margin': 0.05,
+    'min_fill_prob': 0.9,
+    'max_transactions': 50,
+}
+
+
+# ---------------------------------------------------------------- stage cache
+
+def _feed(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(repr(list(obj.columns)).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for k in sorted(obj, key=str):
+            _feed(h, k)
+            _feed(h, obj[k])
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for x in obj:
+            _feed(h, x)
+        h.update(b']')
+    else:
+        h.update(repr(obj).encode())
+        h.update(b';')
+
+
+def content_hash(obj):
+    h = hashlib.sha256()
+    _feed(h, obj)
+    return h.hexdigest()
+
+
+def stage(version):
+    """Mark a pure function as a cacheable stage; bump version when its logic changes."""
+    def wrap(fn):
+        fn.version = version
+        return fn
+    return wrap
+
+
+class Pipeline:
+    """Runs stages, loading the cached result when (stage, version, params, inputs) was seen before."""
+
+    def __init__(self, cache_dir=CACHE_DIR, force=False):
+        self.cache_dir = cache_dir
+        self.force = force
+        self.stats = {}
+        self._keys = {}  # id(result) -> key: a stage's output is identified by its inputs
+
+    def key_of(self, obj):
+        return self._keys.get(id(obj)) or content_hash(obj)
+
+    def run(self, fn, *inputs, **params):
+        name = fn.__name__
+        key = content_hash([name, fn.version, params, [self.key_of(i) for i in inputs]])[:16]
+        path = os.path.join(self.cache_dir, f'{name}-{key}.pkl')
+        t0 = time.perf_counter()
+        cached = not self.force and os.path.exists(path)
+        if cached:
+            with open(path, 'rb') as f:
+                out = pickle.load(f)
+            os.utime(path)  # still in use: keep it from being pruned
+        else:
+            out = fn(*inputs, **params)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        self._keys[id(out)] = key
+        self.stats[name] = {'key': key, 'cached': cached, 'seconds': round(time.perf_counter() - t0, 3)}
+        return out
+
+    def fetch(self, name, fn, *args):
+        """Uncacheable input (live API / DB state): always run; downstream keys use its content."""
+        t0 = time.perf_counter()
+        out = fn(*args)
+        self.stats[name] = {'key': self.key_of(out)[:16], 'cached': False,
+                            'seconds': round(time.perf_counter() - t0, 3)}
+        return out
+
+    def prune(self, days=CACHE_DAYS):
+        cutoff = time.time() - days * 86400
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+
+# ---------------------------------------------------------------- ingest
+
+def history_fingerprint():
+    """(path, size, mtime) of every history CSV: the cache key for parsing them."""
+    files = sorted(f for pattern in HISTORY_GLOBS for f in glob.glob(pattern))
+    return [(f, os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files]
+
+
+@stage(1)
+def ingest_history(fingerprint):
+    return build_transactions()
+
+
+def ingest_account(user_id):
+    """Open orders, realized P&L rows and names of the order items for one user."""
+    ensure_tables()
+    run_consumer(CONSUMERS['pnl'])
+    orders = load_open_orders(user_id)
+    with get_repo().transaction() as tx:
+        pnl = [dict(r) for r in tx.execute(
+            "SELECT * FROM item_pnl WHERE user_id=? ORDER BY item_id", (user_id,))]
+    names = get_repo().item_names({o['item_id'] for o in orders} | {r['item_id'] for r in pnl})
+    return {'orders': orders, 'pnl': pnl, 'names': names}
+
+
+def ingest_prices(item_ids):
+    rows = [{'item_id': p['id'], 'buy': p['buys']['unit_price'], 'sell': p['sells']['unit_price'],
+             'buy_qty': p['buys']['quantity'], 'sell_qty': p['sells']['quantity']}
+            for p in fetch_market_prices(sorted(item_ids))]
+    return pd.DataFrame(rows, columns=['item_id', 'buy', 'sell', 'buy_qty', 'sell_qty'])
+
+
+# ---------------------------------------------------------------- fit
+
+def fit_weibull(durations, max_iter=100):
+    """
+    Weibull MLE (lambda_ hours, rho_) for fully observed durations, the same
+    estimate lifelines' WeibullFitter gives: Newton's method on the shape
+    equation from Menon's starting point.
+    """
+    x = np.maximum(np.asarray(durations, dtype=float), 1 / 60)  # a fill within the minute
+    m = x.max()
+    logy = np.log(x / m)  # scaled to <= 1 so y**rho cannot overflow
+    sd = logy.std()
+    if sd < 1e-9:  # all equal: degenerate, as sharp as we allow
+        return float(m), 1000.0
+    k = math.pi / (math.sqrt(6) * sd)
+    for _ in range(max_iter):
+        yk = np.exp(k * logy)
+        s0, s1, s2 = yk.sum(), (yk * logy).sum(), (yk * logy * logy).sum()
+        f = s1 / s0 - 1 / k - logy.mean()
+        df = (s2 * s0 - s1 * s1) / s0 ** 2 + 1 / k ** 2
+        new_k = k - f / df
+        new_k = min(max(new_k, k / 2), 1000.0)
+        if abs(new_k - k) < 1e-9 * k:
+            k = new_k
+            break
+        k = new_k
+    lam = m * np.exp(k * logy).mean() ** (1 / k)
+    return float(lam), float(k)
+
+
+def ks_statistic(durations, lambda_, rho_):
+    """Kolmogorov-Smirnov distance between the observed fill times and the fitted CDF."""
+    x = np.sort(np.asarray(durations, dtype=float))
+    n = len(x)
+    cdf = 1 - np.exp(-((x / lambda_) ** rho_))
+    i = np.arange(1, n + 1)
+    return float(max((i / n - cdf).max(), (cdf - (i - 1) / n).max()))
+
+
+@stage(1)
+def fit(transactions):
+    """Per-item time-to-fill models from completed sell orders."""
+    sells = transactions[transactions['side'] == 'sell']
+    models = {}
+    for item_id, g in sells.groupby('item_id'):
+        d = g['time_to_fill_hours'].dropna().to_numpy(dtype=float)
+        if len(d) < MIN_OBSERVATIONS:
+            continue
+        lam, rho = fit_weibull(d)
+        models[int(item_id)] = {
+            'item_id': int(item_id),
+            'item_name': g['item_name'].iloc[0],
+            'lambda_': lam,
+            'rho_': rho,
+            'n_observations': len(d),
+            'median_fill_hours': float(np.median(d)),
+            'model_median_hours': lam * math.log(2) ** (1 / rho),
+            'ks': ks_statistic(d, lam, rho),
+        }
+    return models
+
+
+# ---------------------------------------------------------------- score / optimize
+
+@stage(1)
+def score_items(prices, models, catalogue, horizon_days):
+    """Flip economics per catalogue item: buy at bid+1, relist at ask-1, after TP fees."""
+    df = prices.merge(catalogue, on='item_id', how='inner')
+    df = df[(df['buy'] > 0) & (df['sell'] > 0)].copy()
+    df['buy_price'] = df['buy'] + 1
+    df['sell_price'] = np.maximum(df['sell'] - 1, 1)
+    df['profit_unit'] = df['sell_price'] * NET_SELL - df['buy_price']
+    df['margin'] = df['profit_unit'] / df['buy_price']
+    lam = df['item_id'].map(lambda i: models[i]['lambda_'] if i in models else np.nan)
+    rho = df['item_id'].map(lambda i: models[i]['rho_'] if i in models else np.nan)
+    df['fill_prob'] = 1 - np.exp(-((horizon_days * 24 / lam) ** rho))  # NaN without a model
+    df['ev_unit'] = df['fill_prob'] * df['profit_unit']
+    return df.reset_index(drop=True)
+
+
+@stage(1)
+def score_orders(orders, prices, models, horizon_days):
+    by_id = prices.set_index('item_id')
+    quotes = {int(i): (int(r['buy']), int(r['sell'])) for i, r in by_id.iterrows()}
+    fitted = {i: (m['lambda_'], m['rho_']) for i, m in models.items()}
+    return OrderRecommender(horizon_days * 24).evaluate(orders, quotes, fitted)
+
+
+@stage(1)
+def optimize(scored, budget_gold, min_margin, min_fill_prob, max_transactions):
+    """
+    Buy orders maximizing expected profit within the budget: greedy by expected
+    profit per copper invested, up to one full order (250) per item. Greedy by
+    ratio solves the fractional knapsack exactly; the integral answer is at most
+    one partial order worse.
+    """
+    budget = int(budget_gold * 10000)
+    cand = scored[(scored['margin'] >= min_margin)
+                  & (scored['fill_prob'] >= min_fill_prob)
+                  & (scored['ev_unit'] > 0)]
+    cand = cand.assign(ratio=cand['ev_unit'] / cand['buy_price']).sort_values('ratio', ascending=False)
+    picks, left = [], budget
+    for r in cand.itertuples():
+        if len(picks) >= max_transactions:
+            break
+        qty = min(MAX_ORDER_QTY, left // int(r.buy_price))
+        if qty <= 0:
+            continue
+        cost = qty * int(r.buy_price)
+        left -= cost
+        picks.append({
+            'item_id': int(r.item_id),
+            'item_name': r.item_name,
+            'quantity': int(qty),
+            'buy_price': int(r.buy_price),
+            'sell_price': int(r.sell_price),
+            'cost': cost,
+            'margin': round(float(r.margin), 4),
+            'fill_prob': round(float(r.fill_prob), 4),
+            'expected_profit': round(float(r.ev_unit) * qty),
+        })
+    return {
+        'budget': budget,
+        'spent': budget - left,
+        'expected_profit': sum(p['expected_profit'] for p in picks),
+        'candidates': len(cand),
+        'orders': picks,
+    }
+
+
+# ---------------------------------------------------------------- render
+
+@stage(1)
+def build_report(user_id, as_of, params, plan, actions, models, account):
+    names = account['names']
+    pnl = []
+    for r in account['pnl']:
+        avg_cost = r['bought_copper'] / r['bought_qty'] if r['bought_qty'] else 0
+        pnl.append({
+            'item_id': r['item_id'],
+            'item_name': names.get(r['item_id'], f"#{r['item_id']}"),
+            'bought_qty': r['bought_qty'],
+            'sold_qty': r['sold_qty'],
+            'fees': r['fees_copper'],
+            # sold at realized prices minus fees, against the average buy cost of what was sold
+            'realized': round(r['sold_copper'] - r['fees_copper'] - avg_cost * r['sold_qty']),
+        })
+    pnl.sort(key=lambda r: r['realized'], reverse=True)
+    actions = [{**a, 'item_name': names.get(a['item_id'], f"#{a['item_id']}")} for a in actions]
+    fits = sorted(models.values(), key=lambda m: m['ks'], reverse=True)
+    return {
+        'user_id': user_id,
+        'as_of': as_of,
+        'params': params,
+        'buys': plan,
+        'order_actions': {
+            'counts': {k: sum(a['action'] == k for a in actions) for k in ('keep', 'reprice', 'cancel')},
+            'orders': sorted(actions, key=lambda a: (a['action'] == 'keep', -max(a['ev'].values()))),
+        },
+        'pnl': {'realized': sum(r['realized'] for r in pnl), 'fees': sum(r['fees'] for r in pnl), 'items': pnl},
+        'models': {
+            'fitted': len(models),
+            'median_ks': round(float(np.median([m['ks'] for m in fits])), 4) if fits else None,
+            'worst_fit': [{k: (round(v, 4) if isinstance(v, float) else v) for k, v in m.items()}
+                          for m in fits[:10]],
+        },
+    }
+
+
+def coin(c):
+    c = int(round(c or 0))
+    sign, c = ('-' if c < 0 else ''), abs(c)
+    return f"{sign}{c // 10000}g {c // 100 % 100:02d}s {c % 100:02d}c"
+
+
+_env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+                   autoescape=select_autoescape(['html']))
+_env.filters['coin'] = coin
+
+
+@stage(1)
+def render(report):
+    """(json_text, html_text); the HTML embeds the content hash of the JSON it shows."""
+    body = json.dumps(report, separators=(',', ':'), sort_keys=True)
+    sha = hashlib.sha256(body.encode()).hexdigest()
+    html = _env.get_template('report.html').render(r=report, sha=sha)
+    return body, html, sha
+
+
+def _write_atomic(path, text):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def report_dir(user_id):
+    return os.path.join(REPORT_DIR, str(user_id))
+
+
+def publish(user_id, body, html, sha, stats, params, as_of):
+    """Write the hashed artifacts (once per content) and point latest.json at them."""
+    out = report_dir(user_id)
+    os.makedirs(out, exist_ok=True)
+    names = {'json': f'report-{sha[:16]}.json', 'html': f'report-{sha[:16]}.html'}
+    for kind, text in (('json', body), ('html', html)):
+        path = os.path.join(out, names[kind])
+        if not os.path.exists(path):
+            _write_atomic(path, text)
+    manifest = {
+        'user_id': user_id,
+        'as_of': as_of,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'sha256': sha,
+        **names,
+        'params': params,
+        'stages': stats,
+    }
+    _write_atomic(os.path.join(out, 'latest.json'), json.dumps(manifest, indent=2))
+    # prune artifacts older than KEEP_DAYS (never the ones just published)
+    cutoff = time.time() - KEEP_DAYS * 86400
+    for path in glob.glob(os.path.join(out, 'report-*')):
+        if os.path.basename(path) not in names.values() and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    return manifest
+
+
+# ---------------------------------------------------------------- pipeline
+
+def run_report(user_id=1, force=False, **params):
+    params = {**DEFAULTS, **params}
+    pipe = Pipeline(force=force)
+
+    as_of = datetime.utcnow().isoformat(timespec='seconds')
+    catalogue = pd.read_csv(CATALOGUE_PATH)[['item_id', 'item_name']].drop_duplicates('item_id')
+    transactions = pipe.run(ingest_history, history_fingerprint())
+    account = pipe.fetch('ingest_account', ingest_account, user_id)
+    prices = pipe.fetch('ingest_prices', ingest_prices,
+                        set(catalogue['item_id']) | {o['item_id'] for o in account['orders']})
+
+    models = pipe.run(fit, transactions)
+    if not pipe.stats['fit']['cached'] and models:
+        write_store(models)  # the web app's fill models follow the daily refit
+
+    scored = pipe.run(score_items, prices, models, catalogue, horizon_days=params['horizon_days'])
+    actions = pipe.run(score_orders, account['orders'], prices, models, horizon_days=params['horizon_days'])
+    plan = pipe.run(optimize, scored, **{k: params[k] for k in
+                                         ('budget_gold', 'min_margin', 'min_fill_prob', 'max_transactions')})
+
+    report = pipe.run(build_report, user_id, as_of, params, plan, actions, models, account)
+    body, html, sha = pipe.run(render, report)
+    manifest = publish(user_id, body, html, sha, pipe.stats, params, as_of)
+    pipe.prune()
+    return manifest
+
+
+def report_users():
+    """Everyone with an API key; the .env user in single-user mode."""
+    ensure_tables()
+    return get_repo().users_with_api_key() or [int(os.getenv('TP_USER_ID', '1'))]
+
+
+def schedule(at='03:00', **params):
+    hour, minute = map(int, at.split(':'))
+    while True:
+        now = datetime.now()
+        nxt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if nxt <= now:
+            nxt += timedelta(days=1)
+        print(f"next report at {nxt:%Y-%m-%d %H:%M}", flush=True)
+        time.sleep((nxt - now).total_seconds())
+        for user_id in report_users():
+            try:
+                m = run_report(user_id, **params)
+                print(f"user {user_id}: {m['html']}", flush=True)
+            except Exception as e:  # one user's failure must not stop the others
+                print(f"user {user_id}: failed: {type(e).__name__}: {e}", flush=True)
+
+
+_latest = {}
+
+
+def latest_report(user_id):
+    """The user's latest.json manifest (re-read only when it changes), or None."""
+    path = os.path.join(report_dir(user_id), 'latest.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _latest.get(user_id)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = _latest[user_id] = (mtime, json.load(f))
+    return cached[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Daily trading report')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    for name in ('run', 'schedule'):
+        p = sub.add_parser(name)
+        p.add_argument('--budget', dest='budget_gold', type=float, default=DEFAULTS['budget_gold'])
+        p.add_argument('--horizon-days', type=float, default=DEFAULTS['horizon_days'])
+        p.add_argument('--min-margin', type=float, default=DEFAULTS['min_margin'])
+        p.add_argument('--min-fill-prob', type=float, default=DEFAULTS['min_fill_prob'])
+        p.add_argument('--max-transactions', type=int, default=DEFAULTS['max_transactions'])
+    sub.choices['run'].add_argument('--user', type=int, help='default: every user with an API key')
+    sub.choices['run'].add_argument('--force', action='store_true', help='ignore cached stages')
+    sub.choices['schedule'].add_argument('--at', default='03:00', help='local time, HH:MM')
+    args = vars(parser.parse_args())
+    cmd = args.pop('cmd')
+
+    if cmd == 'schedule':
+        schedule(args.pop('at'), **args)
+        return
+    user, force = args.pop('user'), args.pop('force')
+    for user_id in ([user] if user is not None else report_users()):
+        m = run_report(user_id, force, **args)
+        stages = ', '.join(f"{k} {'cached' if s['cached'] else str(s['seconds']) + 's'}"
+                           for k, s in m['stages'].items())
+        print(f"user {user_id}: {report_dir(user_id)}/{m['html']}  ({stages})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+scanner.py
+
+Market-wide flip opportunity scanner. Takes full-market price snapshots
+(every tradeable item, ~27k) and scores all of them in one vectorized pass:
+- spread_net: what a flip nets per unit after the 5% listing + 10% exchange fee
+  (best sell * 0.85 - best buy)
+- roi: spread_net / best buy
+- potential: spread_net * daily volume (volume-weighted profit potential)
+
+Each ranking metric keeps an incrementally maintained top-K heap. On a new
+snapshot only items whose prices/quantities changed are rescored; the heap is
+rebuilt from the full arrays only when the changes knocked too many members
+out to still prove the top K.
+"""
+
+import heapq
+
+import numpy as np
+
+from indicators import NET_SELL
+
+METRICS = ('spread_net', 'roi', 'potential')
+TOP_K = 500
+
+
+class TopK:
+    """Top-K by score with a slack buffer: min-heap of (score, item_id), size <= 2K."""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.rebuilds = 0
+
+    def rebuild(self, scores):
+        n = min(len(scores), 2 * self.k)
+        if n == 0:
+            self.heap = []
+            return
+        idx = np.argpartition(-scores, n - 1)[:n]
+        idx = idx[np.isfinite(scores[idx])]
+        self.heap = list(zip(scores[idx].tolist(), idx.tolist()))
+        heapq.heapify(self.heap)
+        self.rebuilds += 1
+
+    def update(self, scores, changed):
+        """scores: full array (already rescored); changed: item_ids rescored this pass."""
+        if not self.heap:
+            return self.rebuild(scores)
+        # every unchanged non-member scores <= threshold, so members + changed items
+        # above it still contain the true top K as long as there are K of them
+        threshold = self.heap[0][0]
+        changed_set = set(changed.tolist())
+        kept = [e for e in self.heap if e[1] not in changed_set]
+        cs = scores[changed]
+        up = changed[np.isfinite(cs) & (cs >= threshold)]
+        if len(kept) + len(up) < self.k:
+            return self.rebuild(scores)
+        kept.extend(zip(scores[up].tolist(), up.tolist()))
+        heapq.heapify(kept)
+        while len(kept) > 2 * self.k:
+            heapq.heappop(kept)
+        self.heap = kept
+
+    def top(self, n=None):
+        return heapq.nlargest(min(n or self.k, self.k), self.heap)
+
+
+class OpportunityScanner:
+    def __init__(self, k=TOP_K, size=0):
+        self.k = k
+        self.bid = np.zeros(size, dtype=np.int64)
+        self.ask = np.zeros(size, dtype=np.int64)
+        self.demand = np.zeros(size, dtype=np.int64)   # units wanted by buy orders
+        self.supply = np.zeros(size, dtype=np.int64)   # units listed for sale
+        self.volume = np.zeros(size, dtype=np.float64)  # units/day
+        self.scores = {m: np.full(size, -np.inf) for m in METRICS}
+        self.heaps = {m: TopK(k) for m in METRICS}
+        self.last_rescored = 0
+
+    def __len__(self):
+        return len(self.bid)
+
+    def _grow(self, size):
+        if size <= len(self):
+            return
+        for name in ('bid', 'ask', 'demand', 'supply', 'volume'):
+            arr = getattr(self, name)
+            grown = np.zeros(size, dtype=arr.dtype)
+            grown[:len(arr)] = arr
+            setattr(self, name, grown)
+        for m in METRICS:
+            grown = np.full(size, -np.inf)
+            grown[:len(self.scores[m])] = self.scores[m]
+            self.scores[m] = grown
+
+    def update_arrays(self, ids, bid, ask, demand, supply, volume=None):
+        """Fold a snapshot given as parallel arrays; only changed items are rescored."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return 0
+        self._grow(int(ids.max()) + 1)
+        if volume is None:
+            # no traded-volume history yet: the thinner side of the book caps what can flip
+            volume = np.minimum(demand, supply)
+        volume = np.asarray(volume, dtype=np.float64)
+
+        changed = ((self.bid[ids] != bid) | (self.ask[ids] != ask) |
+                   (self.demand[ids] != demand) | (self.supply[ids] != supply) |
+                   (self.volume[ids] != volume))
+        ids, bid, ask = ids[changed], np.asarray(bid)[changed], np.asarray(ask)[changed]
+        self.bid[ids], self.ask[ids] = bid, ask
+        self.demand[ids] = np.asarray(demand)[changed]
+        self.supply[ids] = np.asarray(supply)[changed]
+        self.volume[ids] = volume[changed]
+
+        tradeable = (bid > 0) & (ask > 0)
+        spread = np.where(tradeable, ask * NET_SELL - bid, -np.inf)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roi = np.where(tradeable, spread / bid, -np.inf)
+        self.scores['spread_net'][ids] = spread
+        self.scores['roi'][ids] = roi
+        self.scores['potential'][ids] = np.where(tradeable, spread * self.volume[ids], -np.inf)
+
+        for m in METRICS:
+            self.heaps[m].update(self.scores[m], ids)
+        self.last_rescored = len(ids)
+        return len(ids)
+
+    def update(self, prices, volume=None):
+        """Fold a list of /v2/commerce/prices entries."""
+        n = len(prices)
+        ids = np.fromiter((p['id'] for p in prices), dtype=np.int64, count=n)
+        bid = np.fromiter((p['buys']['unit_price'] for p in prices), dtype=np.int64, count=n)
+        ask = np.fromiter((p['sells']['unit_price'] for p in prices), dtype=np.int64, count=n)
+        demand = np.fromiter((p['buys']['quantity'] for p in prices), dtype=np.int64, count=n)
+        supply = np.fromiter((p['sells']['quantity'] for p in prices), dtype=np.int64, count=n)
+        return self.update_arrays(ids, bid, ask, demand, supply, volume)
+
+    def sync_indicators(self, state):
+        """Pull the latest snapshot out of an indicators.IndicatorState."""
+        a = state.a
+        ids = np.flatnonzero(a['n_obs'])
+        vel = a['velocity'][ids] * 24
+        fallback = np.minimum(a['buy_qty'][ids], a['sell_qty'][ids])
+        volume = np.where(a['n_obs'][ids] > 1, vel, fallback)
+        return self.update_arrays(ids, a['buy'][ids], a['sell'][ids],
+                                  a['buy_qty'][ids], a['sell_qty'][ids], volume)
+
+    def _row(self, i):
+        return {
+            'item_id': int(i),
+            'buy': int(self.bid[i]),
+            'sell': int(self.ask[i]),
+            'spread_net': round(float(self.scores['spread_net'][i]), 1),
+            'roi': round(float(self.scores['roi'][i]), 4),
+            'potential': round(float(self.scores['potential'][i]), 1),
+            'volume': round(float(self.volume[i]), 1),
+            'demand': int(self.demand[i]),
+            'supply': int(self.supply[i]),
+        }
+
+    def ranked(self, metric='potential', min_price=None, max_price=None,
+               min_roi=None, min_volume=None):
+        """item_ids best-first by metric. Unfiltered reads come straight from the heap."""
+        if metric not in METRICS:
+            raise ValueError(f'unknown metric {metric!r}; use one of {METRICS}')
+        if min_price is None and max_price is None and min_roi is None and min_volume is None:
+            return [i for _, i in self.heaps[metric].top()]
+        # filtered: one vectorized pass over the whole market
+        mask = np.isfinite(self.scores[metric])
+        if min_price is not None:
+            mask &= self.bid >= min_price
+        if max_price is not None:
+            mask &= self.bid <= max_price
+        if min_roi is not None:
+            mask &= self.scores['roi'] >= min_roi
+        if min_volume is not None:
+            mask &= self.volume >= min_volume
+        ids = np.flatnonzero(mask)
+        return ids[np.argsort(-self.scores[metric][ids], kind='stable')].tolist()
+
+    def page(self, metric='potential', page=1, per_page=50, **filters):
+        """
+        total: every item matching the filters (every scored item when there are
+        none). ranked: how many of them can be paged through, the same except for
+        unfiltered reads, which only go TOP_K deep.
+        """
+        ranked = self.ranked(metric, **filters)
+        if all(v is None for v in filters.values()):
+            total = int(np.count_nonzero(np.isfinite(self.scores[metric])))
+        else:
+            total = len(ranked)
+        start = (max(page, 1) - 1) * per_page
+        return {
+            'metric': metric,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'ranked': len(ranked),
+            'items': [self._row(i) for i in ranked[start:start + per_page]],
+        }
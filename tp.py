@@ -9,112 +9,121 @@ A Flask dashboard that shows:
 - Daily snapshot sparklines & volume history
 - Favorites stub and volume API
 """
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_from_directory, abort
 from flask import session, redirect, url_for  # for login/logout
-from users import verify_user, create_user, get_api_key
-import os, requests, sqlite3
+import auth
+import os, requests, hashlib, json, math, threading
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from datetime import date
-from db import ensure_tables
-from orders import persist_current_orders
-from users import create_user, verify_user, get_api_key
+from datetime import date, datetime
+from db import ensure_tables, get_repo
+from orders import persist_current_orders, orders_page
+from indicators import load_cached as load_indicators
+from scanner import OpportunityScanner
+from order_recommender import OrderRecommender, load_open_orders, prices_from_indicators
+from model_store import STORE_PATH, build_from_json, open_store
+from favorites import add_fav, list_favs, remove_fav, watchlist, watchlist_version
+from report import latest_report, report_dir
+from crawl import CrawlIncomplete, fetch_ids
 
 # Load environment variables from .env
 load_dotenv()
 ensure_tables()  # make sure tables exist on boot
+if not os.path.exists(STORE_PATH):
+    build_from_json()  # first boot: item_id-keyed fill models from the notebook's JSON
 
 # Choose which user_id to write under (for now via .env; later via login/session)
 USER_ID = int(os.getenv('TP_USER_ID', '1'))
 
-# Build auth header for GW2 API (still using single .env key for now)
+# Build auth header for GW2 API: the logged-in user's key, else the single .env key
 def auth_header():
-    key = os.getenv('GW2_KEY')
+    key = auth.api_key(current_user_id()) or os.getenv('GW2_KEY')
     if not key:
         raise RuntimeError('GW2_KEY not set in environment')
     return {'Authorization': f'Bearer {key}'}
 
-BASE = 'https://api.guildwars2.com/v2'
+BASE = os.getenv('GW2_API_BASE', 'https://api.guildwars2.com/v2')
 app  = Flask(__name__)
+# Behind TP_PROXY_HOPS trusted reverse proxies, the client address (login throttling is
+# per IP) comes from their X-Forwarded-For. 0 (default) trusts none: without a proxy the
+# header is client-supplied. gunicorn.conf.py sets 1 for its loopback bind.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('TP_PROXY_HOPS', '0')))
+recommender = OrderRecommender()   # keeps last pass so polls only re-score what changed
+fill_models = open_store()         # mmap'd, shared by all workers; picks up new fits itself
+scanner = OpportunityScanner()     # re-synced whenever indicators.npz changes
+_scanned = {'state': None}
+_scan_lock = threading.Lock()     # scanner/_scanned are shared by the worker's threads
 #for user management, use a secret key for session signing
 app.secret_key = os.getenv("FLASK_SECRET", "dev-secret")
 
+# One pooled session per worker process (keep-alive to the GW2 API)
+http = requests.Session()
+
 # Generic GET helper
 def gw2_get(path: str):
     url  = f"{BASE}/{path}"
-    resp = requests.get(url, headers=auth_header(), timeout=10)
+    resp = http.get(url, headers=auth_header(), timeout=10)
     resp.raise_for_status()
     return resp.json()
 
+# Bulk ?ids= lookups inside a request: chunked and retried by crawl.py, with at most
+# CRAWL_WAIT s of backoff; what did arrive is used rather than a 500. No checkpoint:
+# concurrent requests for the same ids would share (and delete) one.
+CRAWL_WAIT = 5
+
+def gw2_bulk(path, ids, **kw):
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return []
+    try:
+        return fetch_ids(path, ids, http=http, max_wait=CRAWL_WAIT, base=BASE,
+                         checkpoint=False, **kw)
+    except CrawlIncomplete as e:
+        app.logger.warning(str(e))
+        return e.results
+
+
+# Logged-in user, or the .env user in single-user mode
+def current_user_id():
+    return session.get('user_id', USER_ID)
 
 # Fetch open buy/sell orders and persist per-user
 def fetch_orders():
     buys  = gw2_get('commerce/transactions/current/buys')
     sells = gw2_get('commerce/transactions/current/sells')
-    persist_current_orders(USER_ID, buys, sells)   # pass user_id
+    persist_current_orders(current_user_id(), buys, sells)  # the orders of the key we fetched with
     return buys, sells
 
 # Fetch delivery box summary
 def fetch_deliveries():
     return gw2_get('commerce/delivery')
 
-# Bulk lookup item names via /v2/items
+# Bulk lookup item names via /v2/items (cached in the items table; names don't change)
 def fetch_names(item_ids):
-    names = {}
-    ids   = list(item_ids)
-    for i in range(0, len(ids), 200):
-        chunk = ids[i:i+200]
-        data  = gw2_get(f"items?ids={','.join(map(str,chunk))}")
-        for entry in data:
-            names[entry['id']] = entry['name']
+    ids = list(item_ids)
+    repo = get_repo()
+    names = repo.item_names(ids)
+    missing = [i for i in ids if i not in names]
+    fetched = {entry['id']: entry['name'] for entry in gw2_bulk('items', missing)}
+    if fetched:
+        repo.save_item_names(fetched)
+    names.update(fetched)
     return names
 
-# Upsert daily gold snapshot and item volumes (unchanged; global snapshots)
+# Upsert daily gold snapshot and item volumes (global snapshots; latest prices for the watchlist)
 def upsert_snapshot(grand_copper, item_ids):
-    conn = sqlite3.connect('tp.sqlite')
-    c = conn.cursor()
-
-    # daily_snapshots table
-    c.execute('''
-      CREATE TABLE IF NOT EXISTS daily_snapshots (
-          snapshot_date TEXT PRIMARY KEY,
-          grand_copper   INTEGER NOT NULL
-      )
-    ''')
-
     today = date.today().isoformat()
-    c.execute("""
-      INSERT INTO daily_snapshots (snapshot_date, grand_copper)
-      VALUES (?, ?)
-      ON CONFLICT(snapshot_date) DO UPDATE
-        SET grand_copper=excluded.grand_copper
-    """, (today, grand_copper))
-
-    # daily_item_volume table
-    c.execute('''
-      CREATE TABLE IF NOT EXISTS daily_item_volume (
-          item_id       INTEGER,
-          snapshot_date TEXT,
-          volume        INTEGER,
-          PRIMARY KEY(item_id, snapshot_date)
-      )
-    ''')
-
+    now = datetime.utcnow().isoformat(timespec="seconds")
     # fetch current 24 h volumes for those items
-    if item_ids:
-        ids_str = ','.join(map(str, item_ids))
-        prices = gw2_get(f"commerce/prices?ids={ids_str}")
-        for entry in prices:
-            vid = entry['id']
-            vol = entry.get('volume', 0)
-            c.execute("""
-              INSERT INTO daily_item_volume (item_id, snapshot_date, volume)
-              VALUES (?, ?, ?)
-              ON CONFLICT(item_id, snapshot_date) DO UPDATE
-                SET volume=excluded.volume
-            """, (vid, today, vol))
-
-    conn.commit()
-    conn.close()
+    prices = gw2_bulk('commerce/prices', sorted(i for i in item_ids if i is not None), max_age=3600)
+    get_repo().save_market_snapshot(today, grand_copper, prices, now)
+
+# Name, latest prices and today's volume for items outside the user's orders (a new favorite)
+def refresh_items(item_ids):
+    fetch_names(item_ids)
+    prices = gw2_bulk('commerce/prices', sorted(item_ids), max_age=3600)
+    get_repo().save_prices(date.today().isoformat(), prices, datetime.utcnow().isoformat(timespec="seconds"))
 
 @app.route('/')
 def index():
@@ -147,43 +156,18 @@ def index():
         if d.get('item_id') or d.get('id')
     }
     ids |= delivery_ids
+    # favorites the user doesn't trade get their prices and volume history here too
+    watched = ids | set(list_favs(current_user_id()))
 
     # Save daily snapshots and volumes
-    upsert_snapshot(grand_total_copper, ids)
+    upsert_snapshot(grand_total_copper, watched)
 
     # Load last 7 days for sparkline
-    conn = sqlite3.connect('tp.sqlite')
-    c = conn.cursor()
-    c.execute("""
-      SELECT snapshot_date, grand_copper/10000.0
-      FROM daily_snapshots
-      ORDER BY snapshot_date DESC
-      LIMIT 7
-    """)
-    rows = c.fetchall()
-    conn.close()
+    rows = get_repo().recent_snapshots(7)
     dates, values = (zip(*rows[::-1]) if rows else ([], []))
 
-    # Name mapping
-    name_map = fetch_names(ids)
-
-    # Build lists
-    buys = [
-        {'name': name_map.get(o['item_id'], f"#{o['item_id']}"),
-         'quantity': o['quantity'], 'price': o['price']}
-        for o in raw_buys
-    ]
-    sells = [
-        {'name': name_map.get(o['item_id'], f"#{o['item_id']}"),
-         'quantity': o['quantity'], 'price': o['price']}
-        for o in raw_sells
-    ]
-    deliveries = [
-        {'name': name_map.get(d.get('item_id', d.get('id')), f"#{d.get('item_id', d.get('id'))}"),
-         'quantity': d.get('count', d.get('quantity', 0)),
-         'price':    d.get('unit_price', d.get('price', 0))}
-        for d in raw_deliveries_items
-    ]
+    # Cache names for /api/orders and the watchlist (the tables page through it instead of rendering every row)
+    fetch_names(watched)
 
     # Prepare totals for chart
     totals = {
@@ -196,9 +180,8 @@ def index():
     # Render template with all data
     return render_template(
         'index.html',
-        buys=buys,
-        sells=sells,
-        deliveries=deliveries,
+        buy_count=len(raw_buys),
+        sell_count=len(raw_sells),
         total_buy_copper=total_buy_copper,
         total_sell_copper=total_sell_copper,
         total_delivery_copper=total_delivery_copper,
@@ -212,6 +195,38 @@ def index():
 def favorites():
     return render_template('favorites.html')
 
+# Everything the favorites page needs for all favorites in one query; ETag/304 on repeat polls
+@app.route('/api/watchlist')
+def api_watchlist():
+    uid = current_user_id()
+    horizon = request.args.get('horizon_hours', 24, type=float)
+    if not (math.isfinite(horizon) and horizon > 0):   # nan/inf would not even be valid JSON
+        return jsonify({'error': 'horizon_hours must be a positive number'}), 400
+    fill_models.refresh()
+    version = f"{uid}|{horizon}|{watchlist_version(uid)}|{fill_models.version}"
+    etag = hashlib.sha1(version.encode()).hexdigest()
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        items = watchlist(uid, lambda ids: fill_models.fill_probability(ids, horizon))
+        # plain dumps: this is the hot path and key sorting isn't free at 500 rows
+        body = json.dumps({'horizon_hours': horizon, 'items': items}, separators=(',', ':'))
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'  # always revalidate, never stale
+    return resp
+
+@app.post('/api/favorites/<int:item_id>')
+def api_add_favorite(item_id):
+    add_fav(current_user_id(), item_id)
+    refresh_items([item_id])
+    return jsonify({'item_id': item_id, 'favorite': True})
+
+@app.delete('/api/favorites/<int:item_id>')
+def api_remove_favorite(item_id):
+    remove_fav(current_user_id(), item_id)
+    return jsonify({'item_id': item_id, 'favorite': False})
+
 # Item-search API stub
 @app.route('/api/items/search')
 def api_search_items():
@@ -227,39 +242,131 @@ def api_search_items():
 # Volume-history API
 @app.route('/api/volume')
 def api_volume():
-    ids = request.args.get('ids','').split(',')
-    conn = sqlite3.connect('tp.sqlite')
-    c = conn.cursor()
-    placeholders = ','.join('?' for _ in ids)
-    q = f"""
-      SELECT item_id, snapshot_date, volume
-      FROM daily_item_volume
-      WHERE item_id IN ({placeholders})
-      ORDER BY item_id, snapshot_date DESC
-      LIMIT 7
-    """
-    rows = c.execute(q, ids).fetchall()
-    conn.close()
+    ids = [int(i) for i in request.args.get('ids','').split(',') if i.strip().isdigit()]
+    rows = get_repo().volume_history(ids)
     out = {}
     for item_id, dt, vol in rows:
         out.setdefault(item_id, []).append({'date': dt, 'volume': vol})
     for lst in out.values():
         lst.reverse()
     return jsonify(out)
+
+# Market indicators (EWMA, volatility, net spread, velocity); whole market if no ids
+@app.route('/api/indicators')
+def api_indicators():
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    df = load_indicators().frame(ids or None)
+    return jsonify({int(k): v for k, v in df.to_dict('index').items()})
+
+# Open orders one page at a time (keyset cursor), sorted by item / price / age / capital
+@app.route('/api/orders')
+def api_orders():
+    args = request.args
+    try:
+        page = orders_page(
+            current_user_id(),
+            args.get('side', 'buy'),
+            args.get('sort', 'capital'),
+            args.get('dir', 'desc') != 'asc',
+            cursor=args.get('cursor'),
+            limit=max(1, min(args.get('limit', 100, type=int), 500)),
+            name=args.get('q', '').strip() or None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+# Keep / reprice / cancel for every open order of the current user
+@app.route('/api/orders/actions')
+def api_order_actions():
+    orders = load_open_orders(current_user_id())
+    ids = {o['item_id'] for o in orders}
+    prices = prices_from_indicators(ids)
+    missing = sorted(ids - prices.keys())  # unknown to the indicators, or stale there
+    for p in gw2_bulk('commerce/prices', missing, max_age=3600):
+        prices[p['id']] = (p['buys']['unit_price'], p['sells']['unit_price'])
+    with recommender.lock:  # last_recomputed of this pass, not another thread's
+        recs = recommender.evaluate(orders, prices, fill_models)
+        recomputed = recommender.last_recomputed
+    return jsonify({'recomputed': recomputed, 'orders': recs})
+
+# Order lifecycle events after a given seq, for live updates (clients keep their own offset)
+@app.route('/api/orders/events')
+def api_order_events():
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    events = get_repo().order_events(current_user_id(), after, limit)
+    return jsonify({'events': events, 'next': events[-1]['seq'] if events else after})
+
+# Market-wide flip opportunities, ranked by spread_net / roi / potential
+@app.route('/api/opportunities')
+def api_opportunities():
+    args = request.args
+    filters = {
+        k: args.get(k, type=float)
+        for k in ('min_price', 'max_price', 'min_roi', 'min_volume')
+    }
+    state = load_indicators()
+    try:
+        with _scan_lock:
+            if state is not _scanned['state']:
+                scanner.sync_indicators(state)   # only items that moved are rescored
+                _scanned['state'] = state
+            result = scanner.page(
+                args.get('sort', 'potential'),
+                page=args.get('page', 1, type=int),
+                per_page=max(1, min(args.get('per_page', 50, type=int), 200)),
+                **filters,
+            )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+# Daily report (report.py) served as the static files it wrote; nothing computed per request
+def _report_file(kind):
+    uid = current_user_id()
+    m = latest_report(uid)
+    if m is None:
+        abort(404, description="No report yet: run `python report.py run`.")
+    return send_from_directory(os.path.abspath(report_dir(uid)), m[kind],
+                               etag=m['sha256'], max_age=0)
+
+@app.route('/plan')
+def plan():
+    return _report_file('html')
+
+@app.route('/api/report')
+def api_report():
+    return _report_file('json')
+
+# Artifacts are named by content hash, so they never change
+@app.route('/reports/<name>')
+def report_artifact(name):
+    return send_from_directory(os.path.abspath(report_dir(current_user_id())), name, max_age=31536000)
 ##login/logout routes
 
 
 @app.post('/login')
 def login():
-    uid = verify_user(request.form.get('email',''), request.form.get('password',''))
+    try:
+        uid = auth.login(request.form.get('email',''), request.form.get('password',''), request.remote_addr)
+    except auth.Throttled as e:
+        return _retry_later(str(e), 429, e.retry_after)
+    except (TimeoutError, BrokenProcessPool):
+        return _retry_later('Login is busy, try again in a moment.', 503, 2)
     if uid: session['user_id'] = uid
     return redirect(url_for('index'))
 
 @app.post('/logout')
 def logout():
+    uid = session.get('user_id')
     session.clear()
+    if uid: auth.invalidate(uid)
     return redirect(url_for('index'))
 
+def _retry_later(message, status, retry_after):
+    return message, status, {'Retry-After': str(max(1, round(retry_after)))}
+
 @app.get('/register')
 def register_form():
     return render_template('register.html')
@@ -270,9 +377,15 @@ def register_submit():
     pw    = request.form.get('password','')
     key   = request.form.get('api_key','').strip()
     if email and pw and key:
-        session['user_id'] = create_user(email, pw, key)
+        try:
+            session['user_id'] = auth.register(email, pw, key, request.remote_addr)
+        except auth.Throttled as e:
+            return _retry_later(str(e), 429, e.retry_after)
+        except (TimeoutError, BrokenProcessPool):
+            return _retry_later('Registration is busy, try again in a moment.', 503, 2)
     return redirect(url_for('index'))
 
 
+# Dev server only; production goes through wsgi.py (see gunicorn.conf.py)
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,4 +1,4 @@
-from db import _conn, ensure_tables
+from db import ensure_tables, get_repo
 
 import os, hashlib, base64, hmac
 
@@ -13,25 +13,22 @@ def _verify_pw(pw: str, salt_b64: str, hash_b64: str) -> bool:
     dk = hashlib.pbkdf2_hmac("sha256", pw.encode(), salt, 200_000)
     return hmac.compare_digest(dk, expected)
 
-def create_user(email: str, password: str, api_key: str) -> int:
+# hash_pw / verify_pw: where the PBKDF2 runs (auth.py passes its process pool)
+def create_user(email: str, password: str, api_key: str, hash_pw=_hash_pw) -> int:
     ensure_tables()
-    with _conn() as c:
-        row = c.execute("SELECT user_id FROM users WHERE email=?", (email,)).fetchone()
-        if row: return row["user_id"]
-        pw_hash, salt = _hash_pw(password)
-        cur = c.cursor()
-        cur.execute("INSERT INTO users(email,password_hash,salt,api_key) VALUES(?,?,?,?)",
-                    (email, pw_hash, salt, api_key))
-        c.commit()
-        return cur.lastrowid
+    repo = get_repo()
+    row = repo.user_by_email(email)
+    if row: return row["user_id"]
+    pw_hash, salt = hash_pw(password)
+    user_id = repo.create_user(email, pw_hash, salt, api_key)
+    if user_id is None:  # registered concurrently
+        return repo.user_by_email(email)["user_id"]
+    return user_id
 
-def verify_user(email: str, password: str) -> int | None:
-    with _conn() as c:
-        row = c.execute("SELECT user_id,password_hash,salt FROM users WHERE email=?", (email,)).fetchone()
-        if not row: return None
-        return row["user_id"] if _verify_pw(password, row["salt"], row["password_hash"]) else None
+def verify_user(email: str, password: str, verify_pw=_verify_pw) -> int | None:
+    row = get_repo().user_by_email(email)
+    if not row: return None
+    return row["user_id"] if verify_pw(password, row["salt"], row["password_hash"]) else None
 
 def get_api_key(user_id: int) -> str | None:
-    with _conn() as c:
-        row = c.execute("SELECT api_key FROM users WHERE user_id=?", (user_id,)).fetchone()
-        return row["api_key"] if row else None
\ No newline at end of file
+    return get_repo().get_api_key(user_id)
@@ -0,0 +1,10 @@
+"""
+wsgi.py — production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Worker/thread counts come from WEB_CONCURRENCY / WEB_THREADS (see gunicorn.conf.py).
+"""
+from tp import app
+
+application = app